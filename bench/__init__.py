@@ -0,0 +1,7 @@
+"""
+Benchmarks of vizuread on synthetic alignments, see bench/run.py
+
+```verb
+python -m bench.run --out results.json
+```
+"""
@@ -0,0 +1,184 @@
+"""
+Runs the benchmarks and writes the timings as JSON
+
+```verb
+python -m bench.run --depth 50 --read-length 150 --cigar indels --out results.json
+```
+
+Each stage is run `--repeat` times on the same synthetic reads and the best time is kept.
+Compare two runs by diffing their JSON files, the `params` having to be the same.
+The startup_* stages time new python processes importing vizuread only (core) or the plotting layer (plot),
+`matplotlib` telling if matplotlib was imported : it must stay false for the core.
+"""
+
+from argparse import ArgumentParser
+from io import BytesIO
+from pathlib import Path
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from bench.synth import CIGARS, cut_lines, synthetic_sam, write_bam
+from vizu_index import build_index
+from vizu_layout import PILINGS, layout_reads
+from vizu_plot import plot_region
+from vizuread import Read, _parse_cigar_uncached, get_mean_qual, get_reads_from, parse_cigar, parse_records
+
+
+FIXTURE = ROOT / "tests" / "ref.bam"
+FIXTURE_REGION = "chr14:105,709,976-105,710,983"
+RENDERS = ["arrows", "collection"]
+# statements timed in a fresh interpreter : scripts only fetching reads, and the first plot
+STARTUPS = {
+    "python" : "pass",
+    "core" : "from vizuread import Read, get_reads_from, parse_position",
+    "plot" : "from vizu_plot import plot_region; import matplotlib.pyplot",
+}
+
+
+def timed(func, repeat:int) -> float :
+    """best time of `repeat` calls of func, in seconds"""
+    best = float("inf")
+    for _ in range(repeat) :
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def result(stage:str, n:int, seconds:float, **extra) -> dict :
+    return {"stage" : stage, "n" : n, "seconds" : round(seconds, 6), "per_second" : round(n / seconds, 1) if seconds else None, **extra}
+
+
+def startup(statement:str, repeat:int) -> tuple[float, bool] :
+    """best time of a new python process running `statement`, and whether matplotlib was imported by it"""
+    code = f"import sys; {statement}; print('matplotlib' in sys.modules)"
+    best, loaded = float("inf"), None
+    for _ in range(repeat) :
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        best = min(best, time.perf_counter() - start)
+        loaded = out.stdout.strip() == "True"
+    return best, loaded
+
+
+def draw(reads, piling:str, render:str, figsize=(27, 10)) -> tuple[float, float] :
+    """plots reads on a new figure, returns the times spent drawing the canvas and saving it as a png"""
+    fig, ax = plt.subplots(figsize=figsize)
+    start = time.perf_counter()
+    plot_region(ax=ax, reads=reads, piling=piling, render=render)
+    fig.canvas.draw()
+    drawn = time.perf_counter()
+    fig.savefig(BytesIO(), format="png")
+    saved = time.perf_counter()
+    plt.close(fig)
+    return drawn - start, saved - drawn
+
+
+def run(depth:int=30, read_length:int=150, region_length:int=20_000, cigar:str="indels",
+        discordant:float=0.05, seed:int=0, repeat:int=3, render_reads:int=5000) -> dict :
+    """runs every stage and returns the report, see the module docstring"""
+    params = {
+        "depth" : depth, "read_length" : read_length, "region_length" : region_length, "cigar" : cigar,
+        "discordant" : discordant, "seed" : seed, "repeat" : repeat, "render_reads" : render_reads,
+    }
+    results = []
+
+    for name, statement in STARTUPS.items() :
+        seconds, loaded = startup(statement, repeat)
+        results.append(result(f"startup_{name}", 1, seconds, matplotlib=loaded))
+
+    sam = synthetic_sam(depth, read_length, region_length, cigar, discordant, seed=seed)
+    cut = cut_lines(sam)
+    cigars = [line.split("\t")[4] for line in cut]
+
+    results.append(result("read_init", len(cut), timed(lambda : [Read(line) for line in cut], repeat)))
+    results.append(result("read_from_sam", len(sam), timed(lambda : [Read.from_sam(line) for line in sam], repeat)))
+    raw = [line.encode() for line in sam]
+    results.append(result("parse_records", len(raw), timed(lambda : parse_records(raw), repeat)))
+    results.append(result("parse_records_noseq", len(raw), timed(lambda : parse_records(raw, keep_seq=False), repeat)))
+    reads = [Read(line) for line in cut]
+    results.append(result("read_placement", len(reads), timed(lambda : [(r.start, r.end, r.plot_len) for r in [Read(line) for line in cut]], repeat)))
+    results.append(result("parse_cigar", len(cigars), timed(lambda : [parse_cigar(c) for c in cigars], repeat), distinct=len(set(cigars))))
+    results.append(result("parse_cigar_uncached", len(cigars), timed(lambda : [_parse_cigar_uncached(c) for c in cigars], repeat)))
+    quals = [line.split("\t")[8] for line in cut]
+    results.append(result("mean_qual", len(quals), timed(lambda : [get_mean_qual(q) for q in quals], repeat)))
+
+    for piling in PILINGS :
+        layout = layout_reads(reads, piling)
+        results.append(result(f"layout_{piling}", len(reads), timed(lambda : layout_reads(reads, piling), repeat), rows=layout.n_rows))
+
+    # rendering stages on a subset, arrows being slow on big regions
+    subset = reads[:render_reads]
+    for render in RENDERS :
+        for piling in PILINGS :
+            times = [draw(subset, piling, render) for _ in range(repeat)]
+            results.append(result(f"draw_{render}_{piling}", len(subset), min(t[0] for t in times)))
+            results.append(result(f"savefig_{render}_{piling}", len(subset), min(t[1] for t in times)))
+
+    with tempfile.TemporaryDirectory() as tmp :
+        bam = write_bam(sam, Path(tmp) / "synthetic.bam")
+        first, last = sam[0].split("\t")[3], sam[-1].split("\t")[3]
+        position = f"chr14:{first}-{last}"
+        n = len(list(get_reads_from(bam, position, backend="native")))
+        results.append(result("native_fetch", n, timed(lambda : list(get_reads_from(bam, position, backend="native")), repeat)))
+        results.append(result("native_fetch_noseq", n, timed(lambda : list(get_reads_from(bam, position, backend="native", keep_seq=False)), repeat)))
+        results.append(result("discordant_index", len(sam), timed(lambda : build_index(bam), repeat)))
+
+    if FIXTURE.exists() :
+        n = len(list(get_reads_from(FIXTURE, FIXTURE_REGION, backend="native")))
+        results.append(result("fixture_fetch", n, timed(lambda : list(get_reads_from(FIXTURE, FIXTURE_REGION, backend="native")), repeat)))
+
+    return {
+        "params" : params,
+        "environment" : {
+            "python" : platform.python_version(),
+            "platform" : platform.platform(),
+            "matplotlib" : matplotlib.__version__,
+            "numpy" : np.__version__,
+        },
+        "results" : results,
+    }
+
+
+def main(argv=None) -> int :
+    parser = ArgumentParser(prog="python -m bench.run", description="benchmarks of vizuread on synthetic alignments")
+    parser.add_argument("--depth", type=int, default=30, help="mean depth of the synthetic region")
+    parser.add_argument("--read-length", type=int, default=150)
+    parser.add_argument("--region-length", type=int, default=20_000)
+    parser.add_argument("--cigar", choices=CIGARS, default="indels", help="complexity of the cigars")
+    parser.add_argument("--discordant", type=float, default=0.05, help="fraction of reads with a mate on another chromosome")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one is kept")
+    parser.add_argument("--render-reads", type=int, default=5000, help="number of reads drawn in the rendering stages")
+    parser.add_argument("-o", "--out", default=None, help="where to write the JSON report (stdout by default)")
+    args = parser.parse_args(argv)
+
+    report = run(
+        args.depth, args.read_length, args.region_length, args.cigar,
+        args.discordant, args.seed, args.repeat, args.render_reads,
+    )
+    if args.out :
+        with open(args.out, "w") as fp :
+            json.dump(report, fp, indent=2)
+    else :
+        json.dump(report, sys.stdout, indent=2)
+
+    for r in report["results"] :
+        print(f"{r['stage']:<32} {r['n']:>8} {r['seconds']:>10.4f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__" :
+    sys.exit(main())
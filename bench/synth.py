@@ -0,0 +1,225 @@
+"""
+Synthetic alignments for the benchmarks : SAM lines with tunable depth, read length, cigar complexity
+and fraction of discordant pairs, and a writer of indexed bam files so the native reader can be measured too
+"""
+
+from array import array
+from pathlib import Path
+import random
+import struct
+import zlib
+
+from vizu_bam import CIGAR_OPS, REF_OPS
+
+
+REFERENCES = [("chr1", 248_956_422), ("chr2", 242_193_529), ("chr11", 135_086_622), ("chr14", 107_043_718)]
+
+# cigar complexities : "simple" has only matches, "clipped" adds soft and hard clips,
+# "indels" adds insertions and deletions, "long" makes long reads with many operations and N/D runs
+CIGARS = ["simple", "clipped", "indels", "long"]
+
+
+def random_cigar(rng:random.Random, read_length:int, complexity:str) -> list[tuple[str, int]] :
+    """returns a list of (operation, length) whose query length is read_length"""
+    if complexity == "simple" :
+        return [("M", read_length)]
+
+    ops = []
+    remaining = read_length
+    if complexity != "indels" and rng.random() < 0.3 :
+        clip = rng.randint(1, max(1, read_length // 5))
+        ops.append((rng.choice("SH"), clip))
+        if ops[-1][0] == "S" :
+            remaining -= clip
+
+    if complexity in {"indels", "long"} :
+        n_events = rng.randint(1, 3) if complexity == "indels" else max(1, read_length // 50)
+        while n_events > 0 and remaining > 10 :
+            match = rng.randint(1, max(1, min(remaining - 2, 2 * read_length // (n_events + 1))))
+            ops.append(("M", match))
+            remaining -= match
+            event = rng.choice("ID") if complexity == "indels" else rng.choice("IDDN")
+            if event == "I" :
+                length = min(rng.randint(1, 5), remaining - 1)
+                if length <= 0 :
+                    break
+                remaining -= length
+            elif event == "N" :
+                length = rng.randint(100, 5000)
+            else :
+                length = rng.randint(1, 5) if complexity == "indels" else rng.randint(1, 300)
+            ops.append((event, length))
+            n_events -= 1
+
+    if remaining > 0 :
+        ops.append(("M", remaining))
+    if complexity == "clipped" and rng.random() < 0.3 and ops[-1][1] > 10 :
+        clip = rng.randint(1, ops[-1][1] // 2)
+        ops[-1] = ("M", ops[-1][1] - clip)
+        ops.append(("S", clip))
+    return ops
+
+
+def synthetic_sam(depth:int=30, read_length:int=150, region_length:int=20_000, cigar:str="indels",
+                  discordant:float=0.05, chrom:str="chr14", start:int=105_700_000, seed:int=0) -> list[str] :
+    """
+    Returns samtools view like lines (11 columns) of reads sorted by position over chrom:start-start+region_length,
+    the number of reads giving the requested mean depth. A fraction `discordant` of reads has a mate on chr11.
+    """
+    if cigar not in CIGARS :
+        raise ValueError(f"cigar has to be one of {CIGARS}")
+    rng = random.Random(seed)
+    n_reads = max(1, depth * region_length // read_length)
+    positions = sorted(rng.randint(start, start + region_length) for _ in range(n_reads))
+
+    lines = []
+    for i, pos in enumerate(positions) :
+        ops = random_cigar(rng, read_length, cigar)
+        query_length = sum(length for op, length in ops if op in "MIS=X")
+        reverse = rng.random() < 0.5
+        if rng.random() < discordant :
+            flag = 1 | (16 if reverse else 32) | 64
+            rnext, pnext = "chr11", rng.randint(69_638_000, 69_640_000)
+        else :
+            flag = 1 | 2 | (16 if reverse else 32) | 64
+            rnext, pnext = "=", pos + rng.randint(-400, 400)
+        seq = "".join(rng.choice("ACGT") for _ in range(query_length))
+        qual = "".join(chr(33 + rng.randint(2, 40)) for _ in range(query_length))
+        cigar_string = "".join(f"{length}{op}" for op, length in ops)
+        lines.append(f"read{i}\t{flag}\t{chrom}\t{pos}\t{rng.randint(0, 60)}\t{cigar_string}\t{rnext}\t{max(pnext, 1)}\t0\t{seq}\t{qual}\n")
+    return lines
+
+
+def cut_lines(sam_lines:list[str]) -> list[str] :
+    """returns the lines the way `cut -f 2,3,4,5,6,7,8,10,11` gives them, the input of Read()"""
+    return ["\t".join(line.rstrip("\n").split("\t")[i] for i in (1, 2, 3, 4, 5, 6, 7, 9, 10)) + "\n" for line in sam_lines]
+
+
+def reg2bin(beg:int, end:int) -> int :
+    """bin of the .bai index of an alignment over [beg, end), 0-based"""
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)) :
+        if beg >> shift == end >> shift :
+            return offset + (beg >> shift)
+    return 0
+
+
+class BgzfWriter() :
+    """writes BGZF blocks, giving the virtual offsets of what is written"""
+    BLOCK = 0xff00
+
+    def __init__(self, path) -> None:
+        self.fp = open(path, "wb")
+        self.buffer = bytearray()
+        self.block_offset = 0
+
+    def tell(self) -> int :
+        return (self.block_offset << 16) | len(self.buffer)
+
+    def write(self, data:bytes) :
+        while len(self.buffer) + len(data) > self.BLOCK :
+            room = self.BLOCK - len(self.buffer)
+            self.buffer += data[:room]
+            data = data[room:]
+            self.flush()
+        self.buffer += data
+        if len(self.buffer) == self.BLOCK :
+            self.flush()
+
+    def flush(self) :
+        if not self.buffer :
+            return
+        self._write_block(bytes(self.buffer))
+        self.buffer.clear()
+
+    def _write_block(self, data:bytes) :
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        bsize = len(cdata) + 25
+        self.fp.write(b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" + struct.pack("<H", bsize))
+        self.fp.write(cdata)
+        self.fp.write(struct.pack("<II", zlib.crc32(data), len(data)))
+        self.block_offset += bsize + 1
+
+    def close(self) :
+        self.flush()
+        self._write_block(b"")  # empty block marking the end of the file
+        self.fp.close()
+
+
+def write_bam(sam_lines:list[str], path, references=REFERENCES) -> Path :
+    """writes sorted SAM lines to an indexed bam file (path and path.bai), returns the path"""
+    path = Path(path)
+    tids = {name : tid for tid, (name, _) in enumerate(references)}
+    writer = BgzfWriter(path)
+
+    text = "@HD\tVN:1.6\tSO:coordinate\n" + "".join(f"@SQ\tSN:{name}\tLN:{length}\n" for name, length in references)
+    header = b"BAM\x01" + struct.pack("<i", len(text)) + text.encode() + struct.pack("<i", len(references))
+    for name, length in references :
+        header += struct.pack("<i", len(name) + 1) + name.encode() + b"\x00" + struct.pack("<i", length)
+    writer.write(header)
+    writer.flush()
+
+    bins = [{} for _ in references]     # per reference, bin -> list of [chunk_beg, chunk_end]
+    linear = [{} for _ in references]   # per reference, 16kb window -> smallest virtual offset
+    seq_codes = {base : code for code, base in enumerate("=ACMGRSVTWYHKDBN")}
+
+    for line in sam_lines :
+        name, flag, chrom, pos, mapq, cigar, rnext, pnext, tlen, seq, qual = line.rstrip("\n").split("\t")[:11]
+        tid, pos, flag = tids[chrom], int(pos) - 1, int(flag)
+        ops = [(int(length), op) for length, op in _split_cigar(cigar)]
+        ref_span = sum(length for length, op in ops if CIGAR_OPS.index(op) in REF_OPS)
+        end = pos + max(ref_span, 1)
+        bin_id = reg2bin(pos, end)
+        next_tid = -1 if rnext == "*" else (tid if rnext == "=" else tids[rnext])
+
+        seq = "" if seq == "*" else seq
+        packed = bytearray((seq_codes[seq[i]] << 4) | (seq_codes[seq[i+1]] if i+1 < len(seq) else 0) for i in range(0, len(seq), 2))
+        qual_bytes = bytes(0xFF for _ in seq) if qual == "*" else bytes(ord(c) - 33 for c in qual)
+        read_name = name.encode() + b"\x00"
+        record = struct.pack(
+            "<iiBBHHHiiii", tid, pos, len(read_name), int(mapq), bin_id, len(ops), flag,
+            len(seq), next_tid, int(pnext) - 1, int(tlen),
+        ) + read_name + array("I", [(length << 4) | CIGAR_OPS.index(op) for length, op in ops]).tobytes() + bytes(packed) + qual_bytes
+
+        voffset = writer.tell()
+        writer.write(struct.pack("<i", len(record)) + record)
+        chunks = bins[tid].setdefault(bin_id, [])
+        if chunks and chunks[-1][1] == voffset :
+            chunks[-1][1] = writer.tell()
+        else :
+            chunks.append([voffset, writer.tell()])
+        for window in range(pos >> 14, ((end - 1) >> 14) + 1) :
+            linear[tid].setdefault(window, voffset)
+
+    writer.close()
+
+    with open(f"{path}.bai", "wb") as fp :
+        fp.write(b"BAI\x01" + struct.pack("<i", len(references)))
+        for tid in range(len(references)) :
+            fp.write(struct.pack("<i", len(bins[tid])))
+            for bin_id, chunks in sorted(bins[tid].items()) :
+                fp.write(struct.pack("<Ii", bin_id, len(chunks)))
+                for chunk_beg, chunk_end in chunks :
+                    fp.write(struct.pack("<QQ", chunk_beg, chunk_end))
+            n_intv = max(linear[tid], default=-1) + 1
+            offsets = []
+            last = 0
+            for window in range(n_intv) :
+                last = linear[tid].get(window, last)
+                offsets.append(last)
+            fp.write(struct.pack(f"<i{n_intv}Q", n_intv, *offsets))
+    return path
+
+
+def _split_cigar(cigar:str) :
+    if cigar == "*" :
+        return []
+    ops, number = [], ""
+    for c in cigar :
+        if c.isdigit() :
+            number += c
+        else :
+            ops.append((number, c))
+            number = ""
+    return ops
@@ -0,0 +1,62 @@
+import asyncio
+import stat
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vizu_async import aget_reads_from
+from vizuread import get_reads_from
+
+BAM = Path(__file__).resolve().parent / "ref.bam"
+REGION = "chr14:105,709,976-105,710,983"
+SAM = [
+    "r1\t97\tchr14\t105710000\t60\t50M\t=\t105710200\t0\t*\t*",
+    "r2\t97\tchr14\t105710100\t60\t50M\tchr11\t69638651\t0\t*\t*",
+    "r3\t97\tchr11\t69638651\t60\t50M\t=\t69638900\t0\t*\t*",
+]
+
+
+def collect(**kwargs) :
+    async def run() :
+        return [r async for r in aget_reads_from(**kwargs)]
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def samtools(tmp_path) :
+    # prints the same sam lines whatever the region, like `samtools view` would
+    sam = tmp_path / "reads.sam"
+    sam.write_text("\n".join(SAM) + "\n")
+    script = tmp_path / "samtools"
+    script.write_text(f"#!{sys.executable}\nimport sys\nsys.stdout.write(open({str(sam)!r}).read())\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script)
+
+
+def fields(read) :
+    return (read.flag, read.chr, read.pos, read.cigar, read.receiver_chr, read.pos_receiver)
+
+
+def test_native_backend() :
+    reads = collect(bam_file=BAM, position=REGION, mate_chrom="chr11")
+    assert [fields(r) for r in reads] == [fields(r) for r in get_reads_from(BAM, REGION, mate_chrom="chr11")]
+
+
+@pytest.mark.parametrize("mate_chrom", [None, "chr11", "chr14"])
+def test_samtools_backend(samtools, mate_chrom) :
+    # "=" is the chromosome of each line, not the one of the region
+    kwargs = dict(bam_file=BAM, position=REGION, samtools_command=samtools, backend="samtools", mate_chrom=mate_chrom)
+    reads = collect(**kwargs)
+    assert [fields(r) for r in reads] == [fields(r) for r in get_reads_from(**kwargs)]
+    if mate_chrom == "chr11" :
+        assert [r.pos for r in reads] == [105710100, 69638651]
+
+
+def test_backend_is_checked() :
+    with pytest.raises(Exception, match="backend argument") :
+        collect(bam_file=BAM, position=REGION, backend="pysam")
+    with pytest.raises(Exception, match="native backend") :
+        collect(bam_file=BAM, position=REGION, samtools_options="-L regions.bed", backend="native")
@@ -0,0 +1,111 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vizu_bam import BamFile, NoIndex, UnknownReference, find_index, parse_filters
+from vizuread import Read, get_reads_from
+
+BAM = Path(__file__).resolve().parent / "ref.bam"
+REGION = ("chr14", 105_709_976, 105_710_983)
+
+
+@pytest.fixture(scope="module")
+def bam() :
+    with BamFile(BAM) as bam :
+        yield bam
+
+
+@pytest.fixture(scope="module")
+def every_read(bam) :
+    return [Read.from_fields(*fields) for fields in bam.fetch("chr14")]
+
+
+def test_region(bam) :
+    records = list(bam.fetch(*REGION))
+    assert len(records) == 25
+    assert records[0][:7] == (97, "chr14", 105710192, 54, "30M", "chr11", 69638651)
+    assert len(records[0][7]) == len(records[0][8]) == 30
+    assert [r[2] for r in records] == sorted(r[2] for r in records)
+    # unmapped reads placed with their mate have no cigar
+    assert sum(r[4] == "*" for r in records) == 2
+
+
+def test_part_of_a_region(bam, every_read) :
+    start, end = 105_710_500, 105_710_600
+    expected = [r for r in every_read if r.pos <= end and r.pos + max(r.ref_span, 1) - 1 >= start]
+    assert [r.pos for r in get_reads_from(BAM, ("chr14", start, end))] == [r.pos for r in expected]
+    assert 0 < len(expected) < 25
+
+
+@pytest.mark.parametrize("options, keep", [
+    ("-f 16", lambda r : r.flag & 16),
+    ("-F 16", lambda r : not r.flag & 16),
+    ("-F 0x10 -F 0x100", lambda r : not r.flag & 0x110),
+    ("-f 1 -f 64", lambda r : r.flag & 65 == 65),
+    ("-q 30", lambda r : r.mapQ >= 30),
+    ("-F2 -q30", lambda r : not r.flag & 2 and r.mapQ >= 30),
+])
+def test_filters(every_read, options, keep) :
+    reads = list(get_reads_from(BAM, REGION, samtools_options=options, backend="native"))
+    assert [(r.pos, r.flag) for r in reads] == [(r.pos, r.flag) for r in every_read if keep(r)]
+
+
+def test_mate_chromosome(every_read) :
+    reads = list(get_reads_from(BAM, REGION, mate_chrom="chr11"))
+    assert reads and [r.pos for r in reads] == [r.pos for r in every_read if r.receiver_chr == "chr11"]
+    assert list(get_reads_from(BAM, REGION, mate_chrom="chrUn")) == []
+
+
+def test_whole_chromosome(bam) :
+    assert len(list(bam.fetch("chr14"))) == 25
+    assert len(list(get_reads_from(BAM, "chr14"))) == 25
+    assert list(bam.fetch("chr1")) == []
+    with pytest.raises(UnknownReference) :
+        list(bam.fetch("chrUn"))
+
+
+def test_keep_seq(bam) :
+    # one query at a time, queries share the reader of the file
+    for fields, short in zip(list(bam.fetch(*REGION)), list(bam.fetch(*REGION, keep_seq=False))) :
+        assert short[:7] == fields[:7]
+        assert short[7] is None and short[8] is None and short[9] == len(fields[7])
+
+
+def test_spans(bam, every_read) :
+    assert list(bam.spans(*REGION)) == [
+        (r.pos, max(r.ref_span, 1), r.flag, r.receiver_chr == "=") for r in every_read
+    ]
+
+
+@pytest.mark.parametrize("options, filters", [
+    ("", {"include" : 0, "exclude" : 0, "min_mapq" : 0}),
+    ("-f 2 -F 0x400 -q30", {"include" : 2, "exclude" : 0x400, "min_mapq" : 30}),
+    ("-F2 -F 16", {"include" : 0, "exclude" : 18, "min_mapq" : 0}),
+    ("-L regions.bed", None),
+    ("-F", None),
+    ("-q high", None),
+    ("-F 2 -M", None),
+    ("--min-MQ 30", None),
+])
+def test_parse_filters(options, filters) :
+    assert parse_filters(options) == filters
+
+
+def test_samtools_fallback() :
+    # options the native backend can't apply
+    with pytest.raises(Exception, match="native backend") :
+        list(get_reads_from(BAM, REGION, samtools_options="-L regions.bed", backend="native"))
+    with pytest.raises(Exception, match="backend argument") :
+        list(get_reads_from(BAM, REGION, backend="pysam"))
+
+
+def test_no_index(tmp_path) :
+    copy = tmp_path / "noindex.bam"
+    shutil.copy(BAM, copy)
+    assert find_index(copy) is None and find_index(BAM) is not None
+    with pytest.raises(NoIndex) :
+        BamFile(copy)
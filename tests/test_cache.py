@@ -0,0 +1,47 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.synth import REFERENCES, synthetic_sam, write_bam
+from vizu_cache import ReadCache
+from vizuread import get_reads_from
+
+START = 105_700_000
+LENGTH = 20_000
+
+
+@pytest.fixture(scope="module")
+def bam(tmp_path_factory) :
+    return write_bam(synthetic_sam(depth=10, region_length=LENGTH, start=START), tmp_path_factory.mktemp("cache") / "synth.bam", REFERENCES)
+
+
+def key(read) :
+    return (read.pos, read.flag, read.cigar, read.receiver_chr, read.pos_receiver)
+
+
+@pytest.mark.parametrize("max_bytes", [500_000_000, 200_000, 20_000])
+def test_random_queries(bam, max_bytes) :
+    # whatever the cache holds, a query returns the reads of a direct fetch
+    rng = random.Random(max_bytes)
+    cache = ReadCache(max_bytes=max_bytes)
+    for _ in range(200) :
+        start = rng.randrange(START - 500, START + LENGTH)
+        region = ("chr14", start, start + rng.choice([10, 300, 2000, 8000]))
+        expected = list(get_reads_from(bam, region, keep_seq=False))
+        got = cache.get_reads(bam, region, keep_seq=False)
+        assert sorted(map(key, got)) == sorted(map(key, expected))
+        assert cache.size <= max_bytes
+        assert cache.size == sum(entry.size for entry in cache.entries.values())
+
+
+def test_merged_entries_stay_in_budget(bam) :
+    # consecutive regions merged in one interval : the budget holds instead of the interval growing
+    cache = ReadCache(max_bytes=200_000)
+    for start in range(START, START + LENGTH, 500) :
+        cache.get_reads(bam, ("chr14", start, start + 499), keep_seq=False)
+        assert cache.size <= cache.max_bytes
+    assert cache.stats["partial_hits"] > 0 and cache.entries
@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vizu_coverage import Coverage
+from vizuread import Read
+
+
+def make_read(pos:int, length:int, flag:int=0, mate:str="=") -> Read :
+    return Read.from_fields(flag, "chr1", pos, 60, f"{length}M", mate, pos + 200, "*", "*", length=length, keep_seq=False)
+
+
+def test_bins_narrower_than_reads() :
+    # one 150 bp read over 10 bp bins : depth 1 in each of the 15 bins it covers
+    coverage = Coverage("chr1", 1, 1000, bins=100).add_reads([make_read(101, 150)])
+    depth = coverage.depth.sum(axis=0)
+    assert np.allclose(depth[10:25], 1)
+    assert np.allclose(depth[:10], 0) and np.allclose(depth[25:], 0)
+
+
+def test_reads_crossing_the_region_edges() :
+    # a 300 bp read over a 100 bp region covers it exactly once
+    coverage = Coverage("chr1", 1001, 1100, bins=10).add_reads([make_read(901, 300)])
+    assert np.allclose(coverage.depth.sum(axis=0), 1)
+
+
+def test_partial_bins() :
+    # 15 bp read starting in the middle of a 10 bp bin
+    coverage = Coverage("chr1", 1, 100, bins=10).add_reads([make_read(6, 15)])
+    depth = coverage.depth.sum(axis=0)
+    assert np.allclose(depth[:3], [0.5, 1, 0])
+    assert np.isclose(depth.sum() * coverage.bin_width, 15)
+
+
+def test_categories() :
+    reads = [make_read(1, 50), make_read(1, 50, flag=0x10), make_read(1, 50, mate="chr2")]
+    coverage = Coverage("chr1", 1, 100, bins=2).add_reads(reads)
+    assert np.allclose(coverage.depth[:, 0], [1, 1, 1, 0])
+    assert np.allclose(coverage.depth[:, 1], 0)
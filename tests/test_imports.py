@@ -0,0 +1,29 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def loads_matplotlib(statement:str) -> bool :
+    """runs `statement` in a new python process, returns whether matplotlib was imported by it"""
+    code = f"import sys; {statement}; print('matplotlib' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return out.stdout.strip() == "True"
+
+
+@pytest.mark.parametrize("statement", [
+    "import vizuread",
+    "from vizuread import Read, get_reads_from, parse_position; list(get_reads_from('tests/ref.bam', 'chr14'))",
+    "import vizu_bam, vizu_cache, vizu_coverage, vizu_layout, vizu_readbatch, vizu_regions",
+    # the plotting layer itself only imports matplotlib when something is drawn
+    "import vizuread; vizuread.plot_region",
+])
+def test_reading_does_not_load_matplotlib(statement) :
+    assert not loads_matplotlib(statement)
+
+
+def test_drawing_loads_matplotlib() :
+    assert loads_matplotlib("import vizu_plot; vizu_plot.mapq_colormaps()")
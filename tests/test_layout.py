@@ -0,0 +1,53 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vizu_layout import _first_fit
+
+
+def naive_first_fit(starts, lengths, padding, max_rows, rightmosts=None) :
+    rows, rightmosts = [], list(rightmosts or [])
+    for start, length in zip(starts, lengths) :
+        row = next((j for j, right_pos in enumerate(rightmosts) if right_pos + padding < start), None)
+        if row is None :
+            if max_rows is not None and len(rightmosts) >= max_rows :
+                rows.append(None)
+                continue
+            row = len(rightmosts)
+            rightmosts.append(0)
+        rightmosts[row] = start + length
+        rows.append(row)
+    return rows, rightmosts
+
+
+def intervals(rng:random.Random, n:int) :
+    # sorted starts like a bam file, with some going backwards like the starts of clipped reverse reads
+    starts, lengths, pos = [], [], 0
+    for _ in range(n) :
+        pos += rng.randrange(0, 40)
+        starts.append(pos - rng.randrange(0, 200) if rng.random() < 0.2 else pos)
+        lengths.append(rng.randrange(1, 300))
+    return starts, lengths
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("padding, max_rows", [(0, None), (20, None), (0, 5), (20, 12)])
+def test_same_as_naive(seed, padding, max_rows) :
+    rng = random.Random(seed)
+    starts, lengths = intervals(rng, 500)
+    assert _first_fit(starts, lengths, padding, max_rows) == naive_first_fit(starts, lengths, padding, max_rows)[0]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_same_as_naive_with_rows_in_use(seed) :
+    # rows already holding intervals, like an IncrementalPile extended on the right
+    rng = random.Random(seed)
+    rightmosts = [rng.randrange(0, 500) for _ in range(rng.randrange(0, 10))]
+    starts, lengths = intervals(rng, 300)
+    expected_rows, expected_rightmosts = naive_first_fit(starts, lengths, 20, 15, rightmosts)
+    assert _first_fit(starts, lengths, 20, 15, rightmosts) == expected_rows
+    assert rightmosts == expected_rightmosts
@@ -0,0 +1,49 @@
+import sys
+from pathlib import Path
+
+import matplotlib
+import numpy as np
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vizu_coverage import Coverage
+from vizu_plot import plot_region
+from vizuread import get_reads_from
+
+BAM = Path(__file__).resolve().parent / "ref.bam"
+REGION = "chr14:105,709,976-105,710,983"
+
+
+def test_generator_input() :
+    fig, ax = plt.subplots()
+    reads = plot_region(ax=ax, reads=get_reads_from(BAM, REGION))
+    assert len(reads) == 25
+    plt.close(fig)
+
+
+def test_generator_input_coverage() :
+    fig, ax = plt.subplots()
+    coverage = plot_region(ax=ax, reads=(r for r in get_reads_from(BAM, REGION)), mode="coverage")
+    assert isinstance(coverage, Coverage) and coverage.n_reads == 25
+    plt.close(fig)
+
+
+def test_empty_generator() :
+    fig, ax = plt.subplots()
+    assert plot_region(ax=ax, reads=iter([]), mode="auto") == []
+    plt.close(fig)
+
+
+def test_coverage_from_spans() :
+    # the coverage of the bam (from the raw records) is the one of the reads
+    fig, ax = plt.subplots()
+    for options in ["", "-F 2 -q 10"] :
+        coverage = plot_region(BAM, REGION, ax, mode="coverage", samtools_options=options)
+        expected = Coverage(coverage.chrom, coverage.start, coverage.end, bins=coverage.bins).add_reads(
+            get_reads_from(BAM, REGION, samtools_options=options)
+        )
+        assert coverage.n_reads == expected.n_reads
+        assert np.allclose(coverage.depth, expected.depth)
+    plt.close(fig)
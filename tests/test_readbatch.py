@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vizu_readbatch import ReadBatch, load_reads, save_reads
+from vizuread import get_reads_from
+
+BAM = Path(__file__).resolve().parent / "ref.bam"
+REGION = "chr14:105,709,976-105,710,983"
+
+
+def fields(read) :
+    return (read.flag, read.chr, read.pos, read.mapQ, read.cigar, read.receiver_chr, read.pos_receiver, read.length)
+
+
+def test_save_and_load(tmp_path) :
+    reads = list(get_reads_from(BAM, REGION, keep_seq=False))
+    batch = load_reads(save_reads(reads, tmp_path / "reads.vzr"))
+    assert [fields(r) for r in batch] == [fields(r) for r in reads]
+    assert list(batch.chr) == [r.chr for r in reads]
+    assert list(batch.mate_chr) == [r.receiver_chr for r in reads]
+
+
+def test_loaded_chromosomes_stay_mapped(tmp_path) :
+    # the chromosome codes are views on the file, names are only decoded when asked for
+    batch = load_reads(save_reads(ReadBatch.from_bam(BAM, REGION), tmp_path / "reads.vzr"))
+    for codes in (batch.chr_code, batch.mate_chr_code) :
+        assert isinstance(codes, np.memmap) and codes.dtype == np.int32
+    assert batch[batch.mate_chr != "="].mate_chr_code.tolist() == batch.mate_chr_code[batch.mate_chr != "="].tolist()
+
+
+def test_empty_batch(tmp_path) :
+    batch = load_reads(save_reads([], tmp_path / "empty.vzr"))
+    assert len(batch) == 0 and len(batch.chr) == 0 and batch.names == []
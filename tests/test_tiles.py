@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+import threading
+
+import matplotlib
+matplotlib.use("Agg")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vizu_tiles import TileStore
+
+BAM = Path(__file__).resolve().parent / "ref.bam"
+INDEX = 105_709_976 // TileStore.tile_width(0)
+
+
+def test_evicted_tile_is_rendered_again(tmp_path) :
+    store = TileStore(BAM, cache_dir=tmp_path)
+    png = store.tile_png("chr14", 0, INDEX)
+    # deleted behind the back of the store, eg by another store of the same directory
+    store.tile_path("chr14", 0, INDEX).unlink()
+    assert store.tile_png("chr14", 0, INDEX) == png
+
+
+def test_concurrent_tiles_with_eviction(tmp_path) :
+    # two stores sharing a small cache directory, evicting each other's tiles while they are served
+    stores = [TileStore(BAM, cache_dir=tmp_path, max_bytes=20_000), TileStore(BAM, cache_dir=tmp_path, max_bytes=20_000, rows=30)]
+    errors = []
+
+    def work(store) :
+        for i in range(30) :
+            try :
+                assert store.tile_png("chr14", i % 3, (INDEX >> (i % 3)) + i % 2)[:4] == b"\x89PNG"
+            except Exception as e :
+                errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(stores[i % 2],)) for i in range(6)]
+    for t in threads : t.start()
+    for t in threads : t.join()
+    assert errors == []
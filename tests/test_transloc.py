@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vizu_transloc import cluster_pairs
+
+
+def test_clusters_do_not_chain() :
+    # 200 pairs 500 bp apart : no candidate spans more than the window
+    pos1 = [i*500 for i in range(200)]
+    candidates = cluster_pairs("chr14", "chr11", pos1, [p + 1000 for p in pos1], "ref.bam", window=1000)
+    assert len(candidates) > 1
+    for c in candidates :
+        assert c.transloc.end1 - c.transloc.start1 <= 1000
+        assert c.transloc.end2 - c.transloc.start2 <= 1000
+
+
+def test_close_pairs_make_one_candidate() :
+    candidates = cluster_pairs("chr14", "chr11", [100, 150, 900, 100], [5000, 5100, 5900, 5000], "ref.bam")
+    assert len(candidates) == 1 and candidates[0].support == 3
@@ -17,6 +17,7 @@ n = []
 for i, r in enumerate(reads) :
     n.append(r)
     if i > 100 : break
+reads.close() # stops samtools
 
 # mean_qual = mean()
 plot_region(ax=ax, reads=n)
@@ -0,0 +1,182 @@
+"""
+asyncio counterparts of get_reads_from and plot_region, for use inside an async web service
+
+```py
+async for read in aget_reads_from(bam, "chr14:105,709,976-105,710,983") :
+    ...
+png = await arender_png(bam, "chr14:105,709,976-105,710,983", piling="compact")
+```
+
+The number of samtools processes running at the same time is limited (see set_max_samtools),
+and cancelling a task kills its samtools process.
+"""
+
+import asyncio
+from io import BytesIO
+from itertools import islice
+import time
+
+from vizu_plot import plot_region
+from vizuread import Read, SamtoolsError, _mate_is_on, _native_filters, _samtools_args, get_reads_from, parse_region
+
+
+MAX_SAMTOOLS = 4
+# number of reads decoded at once by the native reader in a worker thread
+NATIVE_CHUNK = 2000
+# samtools messages kept to be shown in the errors
+STDERR_LIMIT = 64 * 1024
+# bytes read at once from the pipes of samtools
+PIPE_CHUNK = 1024 * 1024
+
+_semaphores = {}    # event loop -> semaphore limiting the number of samtools processes
+
+
+def set_max_samtools(n:int) :
+    """sets the maximal number of samtools processes running at the same time (for the event loops created afterwards)"""
+    global MAX_SAMTOOLS
+    MAX_SAMTOOLS = n
+    _semaphores.clear()
+
+
+def _semaphore() -> asyncio.Semaphore :
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores :
+        # dropping the semaphores of closed loops
+        for closed in [l for l in _semaphores if l.is_closed()] :
+            del _semaphores[closed]
+        _semaphores[loop] = asyncio.Semaphore(MAX_SAMTOOLS)
+    return _semaphores[loop]
+
+
+async def aget_reads_from(bam_file, position, samtools_command="samtools", samtools_options="", backend="auto", keep_seq=True, mate_chrom=None, stats=None) :
+    """
+    Async generator of the reads of a region, same arguments as get_reads_from.
+
+    Indexed bam files are read natively in a worker thread, by chunks of reads.
+    Otherwise samtools is run with asyncio.create_subprocess_exec, its output being read as it comes.
+    With samtools, `stats` only records the parse stage, the fetch being interleaved with the other tasks of the loop.
+    """
+    chrom, start, end = parse_region(position)
+    loop = asyncio.get_running_loop()
+
+    # same choice of backend as get_reads_from
+    if _native_filters(bam_file, chrom, samtools_options, backend) is not None :
+        reads = get_reads_from(
+            bam_file, position, samtools_options=samtools_options, backend="native", keep_seq=keep_seq, mate_chrom=mate_chrom, stats=stats
+        )
+        pending = None
+        try :
+            while True :
+                pending = loop.run_in_executor(None, lambda : list(islice(reads, NATIVE_CHUNK)))
+                chunk = await pending
+                if not chunk :
+                    break
+                for r in chunk :
+                    yield r
+        finally :
+            # if cancelled while a chunk is being read, the generator is still running in its thread
+            # and will be closed when garbage collected
+            if pending is None or pending.done() :
+                reads.close()
+        return
+
+    region = chrom if start is None else f"{chrom}:{start}-{end}"
+    args = _samtools_args(samtools_command, samtools_options, bam_file, region)
+    mate = None if mate_chrom is None else mate_chrom.encode()
+
+    async with _semaphore() :
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stderr = bytearray()
+
+        async def drain_stderr() :
+            # always reading stderr, a full pipe would block samtools
+            while chunk := await process.stderr.read(PIPE_CHUNK) :
+                stderr.extend(chunk)
+                del stderr[:-STDERR_LIMIT]
+
+        stderr_task = asyncio.create_task(drain_stderr())
+        parse = 0.0
+        try :
+            async for line in _lines(process.stdout) :
+                if not line :
+                    continue
+                if mate is not None and not _mate_is_on(line, mate) :
+                    continue
+                if stats is None :
+                    yield Read.from_sam(line, keep_seq=keep_seq)
+                    continue
+                tick = time.perf_counter()
+                read = Read.from_sam(line, keep_seq=keep_seq)
+                parse += time.perf_counter() - tick
+                stats.count("reads")
+                yield read
+
+            await stderr_task
+            if await process.wait() != 0 :
+                raise SamtoolsError(f"'{' '.join(args)}' exited with code {process.returncode} : {stderr.decode(errors='replace')}")
+        finally :
+            if process.returncode is None :
+                process.kill()
+                await process.wait()
+            stderr_task.cancel()
+            if stats is not None :
+                stats.add_time("parse", parse)
+
+
+async def _lines(stream) :
+    """
+    Yields the lines of an asyncio StreamReader (without their newline), whatever their length :
+    `async for line in stream` fails on lines longer than the limit of the stream (64 KiB), eg long reads with their sequence
+    """
+    rest = b""
+    while True :
+        chunk = await stream.read(PIPE_CHUNK)
+        if not chunk :
+            break
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        for line in lines :
+            yield line
+    if rest :
+        yield rest
+
+
+async def aget_reads(bam_file, position, **kwargs) -> list[Read] :
+    """returns the list of the reads of a region, kwargs are the ones of aget_reads_from"""
+    return [r async for r in aget_reads_from(bam_file, position, **kwargs)]
+
+
+def render_png(reads, figsize=(12, 5), dpi=100, title=None, **kwargs) -> bytes :
+    """
+    Plots reads on a new figure and returns the PNG image as bytes. Kwargs are passed to plot_region.
+    The figure doesn't go through pyplot, so this can run in any thread.
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    ax = fig.subplots()
+    if len(reads) > 0 :
+        plot_region(ax=ax, reads=reads, **kwargs)
+    if title is not None :
+        ax.set_title(title)
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+async def arender_png(bam_file=None, region=None, reads=None, executor=None, fetch_kwargs=None, **kwargs) -> bytes :
+    """
+    Returns the PNG image of the reads of a region (or of the given reads), see render_png.
+    Reads are retrieved with aget_reads_from (fetch_kwargs being passed to it),
+    and matplotlib runs in `executor` (the default executor of the loop if None).
+    """
+    if reads is None :
+        if bam_file is None or region is None :
+            raise Exception("either reads or bam_file and region must be defined")
+        reads = await aget_reads(bam_file, region, **(fetch_kwargs or {}))
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, lambda : render_png(reads, **kwargs))
@@ -0,0 +1,370 @@
+"""
+In-process reading of indexed bam files, without samtools
+
+The bam is read by decompressing its BGZF blocks with zlib, and the .bai index is used to seek
+only the blocks overlapping the queried region. Records are decoded into the same fields
+as the ones obtained with `samtools view file.bam | cut -f 2,3,4,5,6,7,8,10,11`.
+
+Specs : https://samtools.github.io/hts-specs/SAMv1.pdf (sections 4.1 and 5.2)
+"""
+
+from pathlib import Path
+import shlex
+import struct
+import zlib
+
+
+CIGAR_OPS = "MIDNSHP=X"
+SEQ_BASES = "=ACMGRSVTWYHKDBN"
+# operations consuming the reference, used to compute where an alignment ends
+REF_OPS = {0, 2, 3, 7, 8}
+# highest position that can be indexed in a .bai, used for queries over whole chromosomes
+MAX_POS = 1 << 29
+
+# every byte of packed sequence gives 2 bases
+_SEQ_PAIRS = [a + b for a in SEQ_BASES for b in SEQ_BASES]
+_QUAL_TO_ASCII = bytes((q + 33) % 256 for q in range(256))
+
+_RECORD = struct.Struct("<iiBBHHHiiii")
+_BLOCK_SIZE = struct.Struct("<i")
+
+
+class BamException(Exception):
+    """base exception for the errors happening while reading a bam file"""
+
+class NoIndex(BamException):
+    """raised when no .bai index could be found next to a bam file"""
+
+class UnknownReference(BamException):
+    """raised when a region is on a chromosome absent from the bam header"""
+
+
+class BgzfReader():
+    """
+    Reads the decompressed content of a BGZF file, positions being BGZF virtual offsets
+    (offset of the compressed block << 16 | offset in the decompressed block)
+    """
+    def __init__(self, path) -> None:
+        self.fp = open(path, "rb")
+        self.block_offset = 0   # offset of the current block in the compressed file
+        self.next_offset = 0    # offset of the next block in the compressed file
+        self.data = b""
+        self.pos = 0            # position in the decompressed current block
+        self.eof = False
+
+    def _load_block(self, offset:int) :
+        self.fp.seek(offset)
+        header = self.fp.read(18)
+        self.block_offset = offset
+        self.data, self.pos = b"", 0
+        self.eof = len(header) < 18
+        if self.eof :
+            self.next_offset = offset
+            return
+        if header[:4] != b"\x1f\x8b\x08\x04" :
+            raise BamException(f"Not a BGZF block at offset {offset} of {self.fp.name}")
+        xlen, = struct.unpack("<H", header[10:12])
+        extra = header[12:] + self.fp.read(xlen - 6)
+        bsize = None
+        i = 0
+        while i < xlen :
+            si1, si2, slen = extra[i], extra[i+1], struct.unpack("<H", extra[i+2:i+4])[0]
+            if si1 == 66 and si2 == 67 :
+                bsize, = struct.unpack("<H", extra[i+4:i+6])
+            i += 4 + slen
+        if bsize is None :
+            raise BamException(f"BGZF block without size at offset {offset} of {self.fp.name}")
+
+        cdata = self.fp.read(bsize - xlen - 19)
+        self.data = zlib.decompress(cdata, -15)
+        self.next_offset = offset + bsize + 1
+
+    def seek(self, voffset:int) :
+        self._load_block(voffset >> 16)
+        self.pos = voffset & 0xFFFF
+
+    def tell(self) -> int :
+        if self.pos == len(self.data) :
+            # at the end of a block, we are at the start of the next one
+            return self.next_offset << 16
+        return (self.block_offset << 16) | self.pos
+
+    def read(self, n:int) -> bytes :
+        chunks = []
+        while n > 0 :
+            if self.pos == len(self.data) :
+                if self.eof :
+                    break
+                self._load_block(self.next_offset)
+                continue
+            chunk = self.data[self.pos:self.pos+n]
+            self.pos += len(chunk)
+            n -= len(chunk)
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def close(self) :
+        self.fp.close()
+
+
+def reg2bins(beg:int, end:int) :
+    """returns the bins that may contain alignments overlapping [beg, end), 0-based"""
+    end -= 1
+    bins = [0]
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)) :
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+    return bins
+
+
+class BaiIndex():
+    """
+    Content of a .bai file : for each reference, the chunks of each bin and the linear index
+    """
+    def __init__(self, path) -> None:
+        with open(path, "rb") as fp :
+            data = fp.read()
+        if data[:4] != b"BAI\x01" :
+            raise BamException(f"{path} is not a bai index")
+
+        n_ref, = struct.unpack_from("<i", data, 4)
+        offset = 8
+        self.bins = []      # for each reference, {bin : [(chunk_beg, chunk_end), ...]}
+        self.linear = []    # for each reference, list of the smallest offsets of 16kb windows
+        for _ in range(n_ref) :
+            n_bin, = struct.unpack_from("<i", data, offset)
+            offset += 4
+            bins = {}
+            for _ in range(n_bin) :
+                bin_id, n_chunk = struct.unpack_from("<Ii", data, offset)
+                offset += 8
+                chunks = struct.unpack_from(f"<{2*n_chunk}Q", data, offset)
+                offset += 16*n_chunk
+                bins[bin_id] = list(zip(chunks[::2], chunks[1::2]))
+            n_intv, = struct.unpack_from("<i", data, offset)
+            offset += 4
+            self.linear.append(struct.unpack_from(f"<{n_intv}Q", data, offset))
+            offset += 8*n_intv
+            self.bins.append(bins)
+
+    def chunks(self, tid:int, beg:int, end:int) :
+        """returns the sorted and merged chunks (virtual offsets) to read for [beg, end), 0-based"""
+        bins = self.bins[tid]
+        linear = self.linear[tid]
+        min_offset = linear[min(beg >> 14, len(linear)-1)] if linear else 0
+
+        chunks = sorted(
+            chunk for b in reg2bins(beg, end) for chunk in bins.get(b, [])
+            if chunk[1] > min_offset
+        )
+        merged = []
+        for cbeg, cend in chunks :
+            if merged and cbeg <= merged[-1][1] :
+                merged[-1][1] = max(merged[-1][1], cend)
+            else :
+                merged.append([cbeg, cend])
+        return merged
+
+
+def find_index(bam_file) :
+    """returns the path of the .bai index of a bam file, or None if there is none"""
+    bam_file = Path(bam_file)
+    for candidate in (Path(f"{bam_file}.bai"), bam_file.with_suffix(".bai")) :
+        if candidate.exists() :
+            return candidate
+    return None
+
+
+def parse_filters(samtools_options:str) :
+    """
+    Returns a dict of the filters given as `samtools view` options which can be applied natively :
+    -f (flags that must all be present), -F (flags that must all be absent), -q (minimal MAPQ).
+    Returns None if there are other options, which need samtools.
+    """
+    filters = {"include" : 0, "exclude" : 0, "min_mapq" : 0}
+    keys = {"-f" : "include", "-F" : "exclude", "-q" : "min_mapq"}
+    args = shlex.split(samtools_options)
+    i = 0
+    while i < len(args) :
+        option = args[i]
+        if option[:2] not in keys :
+            return None
+        if len(option) > 2 :
+            value = option[2:]
+        elif i+1 < len(args) :
+            i += 1
+            value = args[i]
+        else :
+            return None
+        try :
+            number = int(value, 0)
+        except ValueError :
+            return None
+        if keys[option[:2]] == "min_mapq" :
+            filters["min_mapq"] = number
+        else :
+            filters[keys[option[:2]]] |= number
+        i += 1
+    return filters
+
+
+def read_header(bgzf:BgzfReader, path) :
+    """reads the header at the start of a bam file, returns the header text, the reference names and their lengths"""
+    if bgzf.read(4) != b"BAM\x01" :
+        raise BamException(f"{path} is not a bam file")
+    l_text, = struct.unpack("<i", bgzf.read(4))
+    text = bgzf.read(l_text).decode(errors="replace")
+    n_ref, = struct.unpack("<i", bgzf.read(4))
+    references = []
+    lengths = []
+    for _ in range(n_ref) :
+        l_name, = struct.unpack("<i", bgzf.read(4))
+        references.append(bgzf.read(l_name)[:-1].decode())
+        lengths.append(struct.unpack("<i", bgzf.read(4))[0])
+    return text, references, lengths
+
+
+def reference_lengths(bam_file) -> dict :
+    """returns the length of each chromosome of a bam file (does not need an index)"""
+    bgzf = BgzfReader(bam_file)
+    try :
+        _, references, lengths = read_header(bgzf, bam_file)
+    finally :
+        bgzf.close()
+    return dict(zip(references, lengths))
+
+
+class BamFile():
+    """
+    An indexed bam file opened for region queries
+    ```py
+    with BamFile("tests/ref.bam") as bam :
+        for fields in bam.fetch("chr14", 105709976, 105710983, exclude=2) :
+            print(fields)
+    ```
+    """
+    def __init__(self, path, index=None, require_index=True) -> None:
+        self.path = path
+        index = index or find_index(path)
+        if index is None and require_index :
+            raise NoIndex(f"No .bai index found for {path}")
+        self.index = BaiIndex(index) if index is not None else None
+        self.bgzf = BgzfReader(path)
+        self._read_header()
+        self.records_offset = self.bgzf.tell()
+
+    def _read_header(self) :
+        self.text, self.references, self.lengths = read_header(self.bgzf, self.path)
+        self.tids = {name : tid for tid, name in enumerate(self.references)}
+
+    def _records(self, chrom:str, start:int, end:int, include:int, exclude:int, min_mapq:int, mate_chrom:str) :
+        """
+        Yields the raw records overlapping chrom:start-end that pass the filters, see fetch,
+        as (data, unpacked fixed fields, cigar operations, offset of the sequence in data, reference span)
+        """
+        try :
+            tid = self.tids[chrom]
+        except KeyError :
+            raise UnknownReference(f"Chromosome '{chrom}' is not in the header of {self.path}")
+        # -2 never matches a mate, like a mate chromosome absent from the header
+        mate_tid = None if mate_chrom is None else self.tids.get(mate_chrom, -2)
+        beg = max(int(start)-1, 0) if start is not None else 0
+        end = int(end) if end is not None else MAX_POS
+
+        bgzf = self.bgzf
+        for chunk_beg, chunk_end in self.index.chunks(tid, beg, end) :
+            bgzf.seek(chunk_beg)
+            while bgzf.tell() < chunk_end :
+                size_bytes = bgzf.read(4)
+                if len(size_bytes) < 4 :
+                    break
+                data = bgzf.read(_BLOCK_SIZE.unpack(size_bytes)[0])
+                fields = _RECORD.unpack_from(data)
+                ref_id, pos, l_read_name, mapq, _, n_cigar_op, flag, _, next_ref_id, _, _ = fields
+
+                if ref_id != tid or pos >= end :
+                    # records are sorted, nothing more to find in this chunk
+                    break
+                if flag & include != include or flag & exclude or mapq < min_mapq :
+                    continue
+                if mate_tid is not None and next_ref_id != mate_tid :
+                    continue
+
+                offset = 32 + l_read_name
+                cigar = struct.unpack_from(f"<{n_cigar_op}I", data, offset)
+                ref_span = sum(c >> 4 for c in cigar if c & 0xF in REF_OPS)
+                if pos + max(ref_span, 1) <= beg :
+                    continue
+                yield data, fields, cigar, offset + 4*n_cigar_op, ref_span
+
+    def fetch(self, chrom:str, start:int=None, end:int=None, include=0, exclude=0, min_mapq=0, mate_chrom:str=None, keep_seq:bool=True) :
+        """
+        Yields the fields of the reads overlapping chrom:start-end (1-based, inclusive like samtools regions),
+        the whole chromosome if start and end are None.
+        With `mate_chrom`, only the reads whose mate is mapped on this chromosome are decoded and yielded.
+
+        Each item is a tuple (flag, chr, pos, mapQ, cigar, receiver_chr, pos_receiver, seq, qual),
+        the values being the ones samtools would print.
+        With keep_seq=False, the sequence and qualities aren't decoded : seq and qual are None and the length
+        of the read is added as a 10th item, the arguments of vizuread.Read.from_fields either way.
+        """
+        references = self.references
+        for data, fields, cigar, offset, _ in self._records(chrom, start, end, include, exclude, min_mapq, mate_chrom) :
+            ref_id, pos, _, mapq, _, _, flag, l_seq, next_ref_id, next_pos, _ = fields
+
+            if next_ref_id == -1 :
+                receiver_chr = "*"
+            elif next_ref_id == ref_id :
+                receiver_chr = "="
+            else :
+                receiver_chr = references[next_ref_id]
+            cigar_string = "".join(f"{c >> 4}{CIGAR_OPS[c & 0xF]}" for c in cigar) or "*"
+
+            if not keep_seq :
+                yield flag, chrom, pos+1, mapq, cigar_string, receiver_chr, next_pos+1, None, None, l_seq
+                continue
+
+            seq_bytes = data[offset:offset + (l_seq+1)//2]
+            offset += (l_seq+1)//2
+            qual_bytes = data[offset:offset + l_seq]
+
+            if l_seq == 0 :
+                seq, qual = "*", "*"
+            else :
+                seq = "".join([_SEQ_PAIRS[b] for b in seq_bytes])[:l_seq]
+                qual = "*" if qual_bytes[0] == 0xFF else qual_bytes.translate(_QUAL_TO_ASCII).decode()
+
+            yield flag, chrom, pos+1, mapq, cigar_string, receiver_chr, next_pos+1, seq, qual
+
+    def spans(self, chrom:str, start:int=None, end:int=None, include=0, exclude=0, min_mapq=0) :
+        """
+        Yields the reads overlapping chrom:start-end like fetch, but only as a tuple
+        (pos, reference span, flag, mate on the same chromosome), without decoding their cigar, sequence or qualities.
+        This is all a coverage needs (see vizu_coverage.Coverage.add_spans).
+        """
+        for _, fields, _, _, ref_span in self._records(chrom, start, end, include, exclude, min_mapq, None) :
+            yield fields[1]+1, max(ref_span, 1), fields[6], fields[8] == fields[0]
+
+    def scan(self) :
+        """
+        Yields every record of the file in order, without using the index, as a tuple 
+        (ref_id, pos, mapq, flag, next_ref_id, next_pos) of raw values (ids of references, 0-based positions).
+        Nothing else is decoded, this is meant for passes over a whole bam file.
+        """
+        bgzf = self.bgzf
+        bgzf.seek(self.records_offset)
+        while True :
+            size_bytes = bgzf.read(4)
+            if len(size_bytes) < 4 :
+                break
+            data = bgzf.read(_BLOCK_SIZE.unpack(size_bytes)[0])
+            ref_id, pos, _, mapq, _, _, flag, _, next_ref_id, next_pos, _ = _RECORD.unpack_from(data)
+            yield ref_id, pos, mapq, flag, next_ref_id, next_pos
+
+    def close(self) :
+        self.bgzf.close()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
@@ -0,0 +1,171 @@
+"""
+Cache of the reads retrieved from bam files, for the scripts and notebooks that query the same regions again and again
+
+```py
+cache = ReadCache(max_bytes=200_000_000)
+plot_region(bam, "chr14:105,709,976-105,710,983", ax=ax[0], cache=cache)
+plot_region(bam, "chr14:105,710,000-105,710,500", ax=ax[1], cache=cache)   # answered from the cache
+plot_region(bam, "chr14:105,709,000-105,711,983", ax=ax[2], cache=cache)   # only the flanks are fetched
+print(cache.stats)
+```
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+from vizu_bam import MAX_POS
+
+
+# rough memory taken by a Read object without its sequence and qualities, used for the memory budget
+READ_BYTES = 400
+
+
+def overlaps(read, start:int, end:int) -> bool :
+    """returns if the alignment of a read overlaps start-end (1-based, inclusive), the same way samtools does"""
+    return read.pos <= end and read.pos + max(read.ref_span, 1) - 1 >= start
+
+
+def read_size(read) -> int :
+    """estimation of the memory taken by a read"""
+    size = READ_BYTES
+    if read.seq is not None :
+        size += len(read.seq) + len(read.qual)
+    return size
+
+
+class CacheEntry() :
+    """reads of one interval of a chromosome, sorted by position"""
+    def __init__(self, chrom:str, start:int, end:int, reads:list) -> None:
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.reads = reads
+        self.size = sum(read_size(r) for r in reads)
+
+    def __repr__(self) -> str:
+        return f"CacheEntry({self.chrom}:{self.start}-{self.end}, {len(self.reads)} reads)"
+
+
+class ReadCache() :
+    """
+    Keeps the reads of the regions already retrieved, per bam file (path, modification time and size)
+    and options given to get_reads_from.
+
+    A region inside an interval already retrieved is answered from the cache, a region overlapping
+    cached intervals only fetches the positions none of them hold, and is merged with all of them in one interval.
+    The least recently used intervals are evicted once the estimated memory taken by the reads goes over `max_bytes`.
+    A merged interval over `max_bytes` is cut down to the region asked for, and a region over `max_bytes` on its own isn't kept.
+
+    The same Read objects are returned by every query, custom attributes set on them are shared.
+    A cache can be shared by threads, their queries being answered one at a time.
+    """
+    def __init__(self, max_bytes:int=500_000_000) -> None:
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # (source, chrom, start, end) -> CacheEntry, least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits" : 0, "partial_hits" : 0, "misses" : 0, "evictions" : 0, "fetched_reads" : 0}
+
+    def get_reads(self, bam_file, position, samtools_command="samtools", samtools_options="", backend="auto", keep_seq=True, stats=None) -> list :
+        """
+        Returns the list of reads of a region, like `list(get_reads_from(...))` with the same arguments.
+        `stats` only records the reads actually fetched from the bam file.
+        """
+        with self.lock :
+            return self._get_reads(bam_file, position, samtools_command, samtools_options, backend, keep_seq, stats)
+
+    def _get_reads(self, bam_file, position, samtools_command, samtools_options, backend, keep_seq, stats) -> list :
+        from vizuread import parse_region
+        chrom, start, end = parse_region(position)
+        if start is None :
+            start, end = 1, MAX_POS
+
+        stat = os.stat(bam_file)
+        source = (os.path.abspath(bam_file), stat.st_mtime_ns, stat.st_size, samtools_options, backend, keep_seq)
+
+        def fetch(s, e) :
+            from vizuread import get_reads_from
+            reads = list(get_reads_from(
+                bam_file, (chrom, s, e), samtools_command=samtools_command,
+                samtools_options=samtools_options, backend=backend, keep_seq=keep_seq, stats=stats,
+            ))
+            self.stats["fetched_reads"] += len(reads)
+            return reads
+
+        # cached intervals overlapping the region or next to it, by position
+        candidates = sorted(
+            (
+                (key, entry) for key, entry in self.entries.items()
+                if key[0] == source and entry.chrom == chrom and entry.start <= end+1 and entry.end >= start-1
+            ),
+            key=lambda c : (c[1].start, c[1].end),
+        )
+        covering = next(((key, entry) for key, entry in candidates if entry.start <= start and end <= entry.end), None)
+
+        if covering is not None :
+            self.stats["hits"] += 1
+            key, entry = covering
+            self.entries.move_to_end(key)
+        elif candidates :
+            self.stats["partial_hits"] += 1
+            cached = [entry for _, entry in candidates]
+            reads = []
+            for i, entry in enumerate(cached) :
+                # a read overlapping two cached intervals is in both of them
+                reads += [r for r in entry.reads if not any(overlaps(r, e.start, e.end) for e in cached[:i])]
+
+            # positions of the region held by no cached interval, between them or on their flanks
+            gaps, cursor = [], start
+            for entry in cached :
+                if entry.start > cursor :
+                    gaps.append((cursor, entry.start-1))
+                cursor = max(cursor, entry.end+1)
+            if cursor <= end :
+                gaps.append((cursor, end))
+            for gap_start, gap_end in gaps :
+                # reads of a gap overlapping a cached interval are already there
+                reads += [r for r in fetch(gap_start, gap_end) if not any(overlaps(r, e.start, e.end) for e in cached)]
+
+            # keeping the order of samtools, reads sorted by position
+            reads.sort(key=lambda r : r.pos)
+            merged = CacheEntry(chrom, min(start, cached[0].start), max(end, max(e.end for e in cached)), reads)
+            if merged.size > self.max_bytes :
+                # too big for the budget once merged : only the region asked for is kept,
+                # the candidates it doesn't cover stay as they are
+                merged = CacheEntry(chrom, start, end, [r for r in reads if overlaps(r, start, end)])
+            # the new interval replaces the candidates it covers, which are dropped by _replace
+            entry = self._replace(merged, source)
+        else :
+            self.stats["misses"] += 1
+            entry = self._replace(CacheEntry(chrom, start, end, fetch(start, end)), source)
+
+        if entry.start == start and entry.end == end :
+            return list(entry.reads)
+        return [r for r in entry.reads if overlaps(r, start, end)]
+
+    def _replace(self, entry:CacheEntry, source) -> CacheEntry :
+        """stores a new entry, dropping the entries it covers, and evicts if needed. An entry over the budget on its own isn't stored"""
+        if entry.size > self.max_bytes :
+            return entry
+        for key, other in list(self.entries.items()) :
+            if key[0] == source and other.chrom == entry.chrom and entry.start <= other.start and other.end <= entry.end :
+                self.size -= self.entries.pop(key).size
+
+        self.entries[(source, entry.chrom, entry.start, entry.end)] = entry
+        self.size += entry.size
+
+        # the new entry fits in the budget, it is the last one to go
+        while self.size > self.max_bytes :
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+            self.stats["evictions"] += 1
+        return entry
+
+    def clear(self) :
+        with self.lock :
+            self.entries.clear()
+            self.size = 0
+
+    def __repr__(self) -> str:
+        return f"ReadCache({len(self.entries)} intervals, {self.size}/{self.max_bytes} bytes, {self.stats})"
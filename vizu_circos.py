@@ -0,0 +1,147 @@
+"""
+Streaming export of discordant pairs as Circos links and karyotype files
+
+```py
+with CircosWriter("links.txt", "karyotype.txt") as circos :
+    circos.add_index(DiscordantIndex.open(bam))         # every chromosome pair of the bam
+    circos.add_reads(get_discordant_reads(bam, region, "chr11"))
+```
+
+Reads are consumed one at a time, in one pass whatever the number of chromosome pairs : each link line is buffered
+and written by blocks of BUFFER_LINES lines, and the karyotype only keeps the smallest and biggest position seen
+on each chromosome, written when the writer is closed. The memory used doesn't depend on the number of reads.
+
+With `bin_size`, the links are counted per (bin of the read, bin of the mate, strand) instead of being written one by one,
+one line per bin pair with a `support` parameter giving the number of reads, which caps the size of the links file.
+These lines are written when the writer is closed.
+
+Line formats (the ones of vizu_transloc.links_from_reads and kario_from_reads) :
+- links     : `chr1  pos1  pos1  chr2  pos2  pos2  class=is_forward`
+- karyotype : `chr - chr1 1 min-200 max+200 chr1`
+"""
+
+from pathlib import Path
+
+
+# link lines kept in memory before being written
+BUFFER_LINES = 10_000
+# reads taken at once from the columns of a ReadBatch or of a DiscordantIndex
+CHUNK = 65_536
+# added on each side of the positions of a chromosome in the karyotype
+KARYOTYPE_PADDING = 200
+
+
+class CircosWriter() :
+    """
+    Writes the links of reads to `links` and the karyotype of their chromosomes to `karyotype`
+    (paths, either can be None), see the module docstring. To be used as a context manager, or closed with `close`.
+    """
+    def __init__(self, links=None, karyotype=None, bin_size:int=None) -> None:
+        self.links = Path(links) if links is not None else None
+        self.karyotype = Path(karyotype) if karyotype is not None else None
+        self.bin_size = bin_size
+        self.limits = {}    # chromosome -> [min, max] of the positions seen on it, in the order the chromosomes are seen
+        self.bins = {}      # (c1, bin1, c2, bin2, is_forward) -> number of reads
+        self.n_reads = 0
+
+        self._buffer = []
+        self._fp = open(self.links, "w") if self.links is not None else None
+
+    def _see(self, chrom:str, start:int, end:int) :
+        limits = self.limits.get(chrom)
+        if limits is None :
+            self.limits[chrom] = [start, end]
+        else :
+            if start < limits[0] : limits[0] = start
+            if end > limits[1] : limits[1] = end
+
+    def add(self, c1:str, p1:int, c2:str, p2:int, is_forward:bool) :
+        """adds the link of one read on c1:p1 with its mate on c2:p2 ("=" being c1)"""
+        if c2 == "=" :
+            c2 = c1
+        self.n_reads += 1
+        if self.bin_size :
+            b1, b2 = (p1-1) // self.bin_size, (p2-1) // self.bin_size
+            key = (c1, b1, c2, b2, is_forward)
+            self.bins[key] = self.bins.get(key, 0) + 1
+            self._see(c1, b1*self.bin_size + 1, (b1+1)*self.bin_size)
+            self._see(c2, b2*self.bin_size + 1, (b2+1)*self.bin_size)
+            return
+
+        self._see(c1, p1, p1)
+        self._see(c2, p2, p2)
+        if self._fp is not None :
+            self._buffer.append(f"{c1}\t{p1}\t{p1}\t{c2}\t{p2}\t{p2}\tclass={is_forward}\n")
+            if len(self._buffer) >= BUFFER_LINES :
+                self._flush()
+
+    def add_reads(self, reads) :
+        """
+        Adds every read of an iterable of Read objects (consumed one at a time, eg the generator of get_reads_from),
+        of a vizu_readbatch.ReadBatch or of a file written by vizu_readbatch.save_reads
+        """
+        from vizu_readbatch import ReadBatch, load_reads
+
+        if isinstance(reads, (str, Path)) :
+            reads = load_reads(reads)
+        if isinstance(reads, ReadBatch) :
+            # straight from the columns, without building a Read per read
+            names = reads.names
+            for i in range(0, len(reads), CHUNK) :
+                columns = (reads.chr_code, reads.pos, reads.mate_chr_code, reads.mate_pos, reads.is_forward)
+                for c1, p1, c2, p2, is_forward in zip(*(c[i:i+CHUNK].tolist() for c in columns)) :
+                    self.add(names[c1], p1, names[c2], p2, is_forward)
+            return self
+
+        for r in reads :
+            self.add(r.chr, r.pos, r.receiver_chr, r.pos_receiver, r.is_forward)
+        return self
+
+    def add_index(self, index, chromosome_pairs=None) :
+        """
+        Adds the reads of a vizu_index.DiscordantIndex, for the given (c1, c2) pairs or all of them,
+        straight from the memory-mapped records
+        """
+        if chromosome_pairs is None :
+            chromosome_pairs = index.chromosome_pairs()
+        for c1, c2 in chromosome_pairs :
+            records = index.pairs(c1, c2)
+            for i in range(0, len(records), CHUNK) :
+                chunk = records[i:i+CHUNK]
+                forward = (chunk["flag"] & 0x10) == 0
+                for pos, mate_pos, is_forward in zip(chunk["pos"].tolist(), chunk["mate_pos"].tolist(), forward.tolist()) :
+                    self.add(c1, pos, c2, mate_pos, is_forward)
+        return self
+
+    def _flush(self) :
+        self._fp.writelines(self._buffer)
+        self._buffer = []
+
+    def close(self) :
+        """writes what is left of the links (all of them when binned) and the karyotype"""
+        if self._fp is not None :
+            for (c1, b1, c2, b2, is_forward), support in self.bins.items() :
+                s1, s2 = b1*self.bin_size + 1, b2*self.bin_size + 1
+                e1, e2 = s1 + self.bin_size - 1, s2 + self.bin_size - 1
+                self._buffer.append(f"{c1}\t{s1}\t{e1}\t{c2}\t{s2}\t{e2}\tclass={is_forward},support={support}\n")
+                if len(self._buffer) >= BUFFER_LINES :
+                    self._flush()
+            self._flush()
+            self._fp.close()
+            self._fp = None
+
+        if self.karyotype is not None :
+            with open(self.karyotype, "w") as fp :
+                fp.writelines(
+                    f"chr - {c} {c.replace('chr', '')} {max(low - KARYOTYPE_PADDING, 0)} {high + KARYOTYPE_PADDING} {c}\n"
+                    for c, (low, high) in self.limits.items()
+                )
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"CircosWriter({self.links}, {self.karyotype}, {self.n_reads} reads, {len(self.limits)} chromosomes)"
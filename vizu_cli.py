@@ -0,0 +1,175 @@
+"""
+Command line entry point of vizuread
+
+```verb
+python vizuread.py batch manifest.tsv --jobs 8 --summary timings.tsv
+```
+
+The manifest of the `batch` command is either a TSV file with a header line, or a JSON list of objects,
+with the columns/keys : bam, c1, start1, end1, c2, start2, end2, output.
+Each line is a Transloc plot saved to `output`, the jobs being spread over a pool of processes.
+
+```verb
+python vizuread.py index file1.bam file2.bam
+```
+
+Builds the discordant pairs index of bam files (see vizu_index.py).
+
+```verb
+python vizuread.py tiles file.bam --port 8000 --options "-q 10" --piling compact
+```
+
+Serves pre-rendered tiles of a bam file over HTTP (see vizu_tiles.py).
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+
+MANIFEST_COLUMNS = ["bam", "c1", "start1", "end1", "c2", "start2", "end2", "output"]
+
+
+def read_manifest(path) -> list[dict] :
+    """returns the jobs of a TSV or JSON manifest as a list of dicts"""
+    path = Path(path)
+    with open(path) as fp :
+        if path.suffix == ".json" :
+            jobs = json.load(fp)
+        else :
+            jobs = list(csv.DictReader(fp, delimiter="\t"))
+
+    for i, job in enumerate(jobs) :
+        missing = [c for c in MANIFEST_COLUMNS if c not in job]
+        if missing :
+            raise ValueError(f"Job {i+1} of {path} is missing the columns {missing}")
+    return jobs
+
+
+def _init_worker() :
+    # every worker draws on its own non interactive backend
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def render_job(job:dict) -> dict :
+    """plots one job of a manifest, returns its status and timing instead of raising"""
+    from vizu_transloc import Transloc
+
+    start = time.perf_counter()
+    result = {"output" : job["output"], "status" : "ok", "seconds" : 0.0, "error" : ""}
+    try :
+        transloc = Transloc(
+            Path(job["bam"]), job["c1"], int(job["start1"]), int(job["end1"]),
+            job["c2"], int(job["start2"]), int(job["end2"]),
+        )
+        Path(job["output"]).parent.mkdir(parents=True, exist_ok=True)
+        if not transloc.plot(save_to=job["output"]) :
+            result["status"] = "failed"
+            result["error"] = "not enough reads"
+    except Exception as e :
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(jobs:list[dict], n_jobs:int=None) -> list[dict] :
+    """renders every job in a pool of `n_jobs` processes (one per core by default), returns the results in the order of the jobs"""
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count(), initializer=_init_worker) as pool :
+        futures = {pool.submit(render_job, job) : i for i, job in enumerate(jobs)}
+        for future in as_completed(futures) :
+            i = futures[future]
+            try :
+                results[i] = future.result()
+            except Exception as e :
+                # the worker itself died
+                results[i] = {"output" : jobs[i]["output"], "status" : "failed", "seconds" : 0.0, "error" : f"{type(e).__name__}: {e}"}
+            if results[i]["status"] != "ok" :
+                logging.error(f"Job {i+1} ({jobs[i]['output']}) failed : {results[i]['error']}")
+    return results
+
+
+def write_summary(results:list[dict], fp) :
+    writer = csv.DictWriter(fp, fieldnames=["output", "status", "seconds", "error"], delimiter="\t", lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def batch(args) -> int :
+    jobs = read_manifest(args.manifest)
+    start = time.perf_counter()
+    results = run_batch(jobs, args.jobs)
+    elapsed = time.perf_counter() - start
+
+    if args.summary :
+        with open(args.summary, "w") as fp :
+            write_summary(results, fp)
+    else :
+        write_summary(results, sys.stdout)
+
+    failed = sum(r["status"] != "ok" for r in results)
+    print(f"{len(jobs)-failed}/{len(jobs)} plots done in {elapsed:.1f}s, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def index(args) -> int :
+    from vizu_index import DiscordantIndex, build_index
+    for bam in args.bam :
+        start = time.perf_counter()
+        index = DiscordantIndex(build_index(bam))
+        print(f"{index.path} : {len(index)} discordant reads indexed in {time.perf_counter()-start:.1f}s", file=sys.stderr)
+    return 0
+
+
+def tiles(args) -> int :
+    from vizu_tiles import CACHE_DIR, TileStore, serve
+    logging.basicConfig(level=logging.INFO)
+    store = TileStore(
+        args.bam, cache_dir=args.cache_dir or CACHE_DIR, samtools_options=args.options,
+        piling=args.piling, max_bytes=args.max_mb * 1_000_000,
+    )
+    try :
+        serve(store, args.host, args.port)
+    except KeyboardInterrupt :
+        pass
+    return 0
+
+
+def main(argv=None) -> int :
+    parser = ArgumentParser(prog="vizuread", description="IGV-like plots of sequence alignments")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_batch = subparsers.add_parser("batch", help="plot the translocations listed in a TSV or JSON manifest")
+    parser_batch.add_argument("manifest", help=f"TSV (with a header) or JSON manifest with the columns {', '.join(MANIFEST_COLUMNS)}")
+    parser_batch.add_argument("-j", "--jobs", type=int, default=None, help="number of processes, one per core by default")
+    parser_batch.add_argument("-s", "--summary", default=None, help="where to write the TSV summary of the jobs (stdout by default)")
+    parser_batch.set_defaults(func=batch)
+
+    parser_index = subparsers.add_parser("index", help="build the discordant pairs index of bam files (see vizu_index.py)")
+    parser_index.add_argument("bam", nargs="+")
+    parser_index.set_defaults(func=index)
+
+    parser_tiles = subparsers.add_parser("tiles", help="serve pre-rendered tiles of a bam file over HTTP (see vizu_tiles.py)")
+    parser_tiles.add_argument("bam")
+    parser_tiles.add_argument("--host", default="127.0.0.1")
+    parser_tiles.add_argument("--port", type=int, default=8000)
+    parser_tiles.add_argument("--options", default="", help="samtools options filtering the reads, eg '-q 10'")
+    parser_tiles.add_argument("--piling", default="spaced", choices=["compact", "spaced", "seq"])
+    parser_tiles.add_argument("--cache-dir", default=None, help="where the tiles are kept, ~/.cache/vizuread/tiles by default")
+    parser_tiles.add_argument("--max-mb", type=int, default=1000, help="size of the tile cache in MB")
+    parser_tiles.set_defaults(func=tiles)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__" :
+    sys.exit(main())
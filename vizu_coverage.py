@@ -0,0 +1,159 @@
+"""
+Coverage histograms, used by plot_region instead of the reads when a region is too big to draw every read
+
+The reads are streamed into a fixed number of bins, so the memory used doesn't depend on the number of reads.
+Each bin holds the mean depth over its positions, reads being split between the bins they cover.
+Depth is split by strand and by proper pairing, forward reads being drawn above the axis and reverse reads below.
+"""
+
+from dataclasses import dataclass, field
+from heapq import heappush, heappop
+
+import numpy as np
+
+
+# regions wider than this (in bp) are drawn as coverage by plot_region(mode="auto")
+COVERAGE_WIDTH = 100_000
+# plot_region(mode="auto") switches to coverage when a region holds more reads than this
+MAX_READS = 20_000
+COVERAGE_BINS = 1000
+
+CATEGORIES = ["forward_paired", "forward_unpaired", "reverse_paired", "reverse_unpaired"]
+
+# number of reads accumulated before being added to the bins in one numpy operation
+_CHUNK = 65536
+
+
+def category(read) -> int :
+    """index in CATEGORIES of a read"""
+    return (0 if read.is_forward else 2) + (0 if read.is_properly_paired else 1)
+
+
+@dataclass
+class Coverage() :
+    chrom : str
+    start : int
+    end : int
+    bins : int = COVERAGE_BINS
+    n_reads : int = 0
+    depth : np.ndarray = field(default=None, repr=False)   # mean depth per bin, one row per category of CATEGORIES
+    _pending : list = field(default_factory=list, repr=False)
+
+    def __post_init__(self) :
+        self.bins = max(1, min(self.bins, self.end - self.start + 1))
+        if self.depth is None :
+            self.depth = np.zeros((len(CATEGORIES), self.bins))
+
+    @property
+    def edges(self) -> np.ndarray :
+        return np.linspace(self.start, self.end+1, self.bins+1)
+
+    @property
+    def bin_width(self) -> float :
+        return (self.end - self.start + 1) / self.bins
+
+    def add(self, read) :
+        """adds a read to the coverage"""
+        self._pending.append((read.pos, max(read.ref_span, 1), category(read)))
+        self.n_reads += 1
+        if len(self._pending) >= _CHUNK :
+            self._flush()
+
+    def add_reads(self, reads) :
+        """adds every read of an iterable (or of a vizu_readbatch.ReadBatch) to the coverage, returns the coverage"""
+        from vizu_readbatch import ReadBatch
+        if isinstance(reads, ReadBatch) :
+            # straight from the columns, without building a Read per read
+            self._flush()
+            categories = np.where(reads.is_forward, 0, 2) + np.where(reads.is_properly_paired, 0, 1)
+            self._pending.extend(zip(reads.pos.tolist(), np.maximum(reads.ref_span, 1).tolist(), categories.tolist()))
+            self.n_reads += len(reads)
+        else :
+            for r in reads :
+                self.add(r)
+        self._flush()
+        return self
+
+    def add_spans(self, spans) :
+        """
+        adds reads given as (pos, reference span, flag, mate on the same chromosome) tuples,
+        eg from vizu_bam.BamFile.spans, without building a Read per read, returns the coverage
+        """
+        for pos, span, flag, same_chrom in spans :
+            self._pending.append((pos, span, (2 if flag & 0x10 else 0) + (0 if same_chrom else 1)))
+            if len(self._pending) >= _CHUNK :
+                self.n_reads += len(self._pending)
+                self._flush()
+        self.n_reads += len(self._pending)
+        self._flush()
+        return self
+
+    def _flush(self) :
+        if not self._pending :
+            return
+        pos, span, cat = (np.array(a) for a in zip(*self._pending))
+        self._pending.clear()
+        # [pos, pos+span) of each read in bin units, clipped to the region : the bins of both ends get
+        # the fraction of them covered by the read, the bins in between are fully covered (difference array)
+        low = ((pos - self.start) / self.bin_width).clip(0, self.bins)
+        high = ((pos + span - self.start) / self.bin_width).clip(0, self.bins)
+        first = np.minimum(np.floor(low).astype(np.int64), self.bins-1)
+        last = np.minimum(np.floor(high).astype(np.int64), self.bins-1)
+        same = first == last
+        first_part = np.where(same, high - low, first + 1 - low)
+        last_part = np.where(same, 0.0, high - last)
+        inside = (~same).astype(np.float64)
+        for c in range(len(CATEGORIES)) :
+            mask = cat == c
+            diff = (
+                np.bincount(first[mask] + 1, weights=inside[mask], minlength=self.bins+1)
+                - np.bincount(last[mask], weights=inside[mask], minlength=self.bins+1)
+            )
+            self.depth[c] += (
+                np.bincount(first[mask], weights=first_part[mask], minlength=self.bins)
+                + np.bincount(last[mask], weights=last_part[mask], minlength=self.bins)
+                + np.cumsum(diff)[:self.bins]
+            )
+
+    def plot(self, ax, **kwargs) :
+        """
+        Draws the coverage as stacked filled areas on a plt.ax, forward reads above the axis and reverse reads below.
+        Kwargs are passed to ax.fill_between
+        """
+        from vizu_plot import mapq_colors
+        self._flush()
+        x = self.edges
+        colors = [table[200] for table in mapq_colors()]
+        artists = []
+        for sign, (paired, unpaired) in ((1, self.depth[0:2]), (-1, self.depth[2:4])) :
+            # values repeated for the last edge, so the last bin is drawn too with step="post"
+            paired = np.append(paired, paired[-1]) * sign
+            stacked = paired + np.append(unpaired, unpaired[-1]) * sign
+            strand = "forward" if sign > 0 else "reverse"
+            artists.append(ax.fill_between(x, 0, paired, step="post", color=colors[0], label=f"{strand}, properly paired", **kwargs))
+            artists.append(ax.fill_between(x, paired, stacked, step="post", color=colors[1], label=f"{strand}, not properly paired", **kwargs))
+        ax.axhline(0, color="black", linewidth=0.5)
+        return artists
+
+
+class DepthCap() :
+    """
+    Downsampling of reads sorted by position : a read is accepted only if less than `max_depth`
+    accepted reads overlap its start. Reads are checked one at a time, so it works on streams.
+    """
+    def __init__(self, max_depth:int) -> None:
+        self.max_depth = max_depth
+        self.ends = []      # heap of the ends of the accepted reads still overlapping the current position
+        self.n_dropped = 0
+
+    def accept(self, start:int, end:int) -> bool :
+        while self.ends and self.ends[0] < start :
+            heappop(self.ends)
+        if len(self.ends) >= self.max_depth :
+            self.n_dropped += 1
+            return False
+        heappush(self.ends, end)
+        return True
+
+    def accept_read(self, read) -> bool :
+        return self.accept(read.pos, read.pos + max(read.ref_span, 1) - 1)
@@ -0,0 +1,171 @@
+"""
+Index of the discordant pairs of a bam file, to find translocation evidence without scanning chromosomes
+
+The bam is read once, and every read whose mate is mapped on another chromosome is recorded
+in a sidecar file next to the bam (`file.bam.vzdi`). Records are sorted by chromosome pair and position,
+and the file is memory-mapped, so getting all the chr11-chr14 pairs is instant.
+
+```py
+index = DiscordantIndex.open(bam)           # built on first use, rebuilt when the bam changes
+pairs = index.pairs("chr14", "chr11")       # numpy records of reads on chr14 with a mate on chr11
+links_from_reads(index.reads("chr14", "chr11"), [], "links.txt")
+```
+
+File layout : magic, length of the JSON header (uint32), JSON header, padding to 8 bytes, records.
+"""
+
+from array import array
+from pathlib import Path
+import json
+import os
+import struct
+
+import numpy as np
+
+from vizu_bam import BamFile
+
+
+MAGIC = b"VZDI\x01"
+SUFFIX = ".vzdi"
+
+RECORD = np.dtype([
+    ("chr", np.int32),          # reference id of the read
+    ("pos", np.int32),          # 1-based position of the read
+    ("mate_chr", np.int32),     # reference id of the mate
+    ("mate_pos", np.int32),     # 1-based position of the mate
+    ("flag", np.uint16),        # flags of the read, 0x10 giving the strand
+    ("mapQ", np.uint8),
+])
+
+
+def index_path(bam_file) -> Path :
+    return Path(f"{bam_file}{SUFFIX}")
+
+
+def _bam_identity(bam_file) -> dict :
+    stat = os.stat(bam_file)
+    return {"bam_size" : stat.st_size, "bam_mtime_ns" : stat.st_mtime_ns}
+
+
+def build_index(bam_file, path=None) -> Path :
+    """reads the whole bam once and writes the index of its discordant pairs, returns the path of the index"""
+    path = Path(path) if path is not None else index_path(bam_file)
+    columns = {name : array("i") for name in RECORD.names}
+
+    with BamFile(bam_file, require_index=False) as bam :
+        references = bam.references
+        for ref_id, pos, mapq, flag, next_ref_id, next_pos in bam.scan() :
+            if ref_id < 0 or next_ref_id < 0 or ref_id == next_ref_id :
+                continue
+            columns["chr"].append(ref_id)
+            columns["pos"].append(pos+1)
+            columns["mate_chr"].append(next_ref_id)
+            columns["mate_pos"].append(next_pos+1)
+            columns["flag"].append(flag)
+            columns["mapQ"].append(mapq)
+
+    records = np.empty(len(columns["chr"]), dtype=RECORD)
+    for name in RECORD.names :
+        records[name] = np.frombuffer(columns[name], dtype=np.int32)
+    records = records[np.lexsort((records["pos"], records["mate_chr"], records["chr"]))]
+
+    # where the records of each chromosome pair start and how many there are
+    pairs = {}
+    if len(records) :
+        keys = records["chr"].astype(np.int64) * len(references) + records["mate_chr"]
+        boundaries = np.flatnonzero(np.diff(keys)) + 1
+        starts = np.concatenate([[0], boundaries])
+        counts = np.diff(np.concatenate([starts, [len(records)]]))
+        for start, count in zip(starts.tolist(), counts.tolist()) :
+            c1, c2 = references[records["chr"][start]], references[records["mate_chr"][start]]
+            pairs[f"{c1}\t{c2}"] = [start, count]
+
+    header = json.dumps({
+        **_bam_identity(bam_file),
+        "references" : references,
+        "n_records" : len(records),
+        "pairs" : pairs,
+    }).encode()
+    padding = -(len(MAGIC) + 4 + len(header)) % 8
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as fp :
+        fp.write(MAGIC)
+        fp.write(struct.pack("<I", len(header) + padding))
+        fp.write(header + b" " * padding)
+        fp.write(records.tobytes())
+    os.replace(tmp, path)
+    return path
+
+
+class DiscordantIndex() :
+    """
+    Memory-mapped index of the discordant pairs of a bam, see `build_index`
+    """
+    def __init__(self, path) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as fp :
+            if fp.read(len(MAGIC)) != MAGIC :
+                raise ValueError(f"{self.path} is not a discordant pairs index")
+            header_length, = struct.unpack("<I", fp.read(4))
+            self.header = json.loads(fp.read(header_length))
+
+        self.references = self.header["references"]
+        offset = len(MAGIC) + 4 + header_length
+        if self.header["n_records"] :
+            self.records = np.memmap(self.path, dtype=RECORD, mode="r", offset=offset, shape=(self.header["n_records"],))
+        else :
+            self.records = np.empty(0, dtype=RECORD)
+
+    @classmethod
+    def open(cls, bam_file, build=True) -> "DiscordantIndex" :
+        """
+        Opens the index of a bam file, (re)building it if it is missing or if the bam changed since it was built
+        (unless build=False, in which case a FileNotFoundError is raised)
+        """
+        path = index_path(bam_file)
+        if path.exists() :
+            index = cls(path)
+            if index.is_up_to_date(bam_file) :
+                return index
+        if not build :
+            raise FileNotFoundError(f"No up to date discordant pairs index for {bam_file}")
+        return cls(build_index(bam_file, path))
+
+    def is_up_to_date(self, bam_file) -> bool :
+        identity = _bam_identity(bam_file)
+        return all(self.header[key] == value for key, value in identity.items())
+
+    def pairs(self, c1:str, c2:str, start1:int=None, end1:int=None) -> np.ndarray :
+        """
+        Returns the records of the reads on c1 whose mate is on c2 (a view on the memory-mapped file),
+        optionally only the ones positioned between start1 and end1 on c1
+        """
+        start, count = self.header["pairs"].get(f"{c1}\t{c2}", [0, 0])
+        records = self.records[start:start+count]
+        if start1 is not None or end1 is not None :
+            lo = np.searchsorted(records["pos"], int(start1), side="left") if start1 is not None else 0
+            hi = np.searchsorted(records["pos"], int(end1), side="right") if end1 is not None else len(records)
+            records = records[lo:hi]
+        return records
+
+    def chromosome_pairs(self) -> dict :
+        """returns the number of discordant reads per (chromosome, mate chromosome)"""
+        return {tuple(key.split("\t")) : count for key, (_, count) in self.header["pairs"].items()}
+
+    def reads(self, c1:str, c2:str, start1:int=None, end1:int=None) :
+        """
+        Yields Read objects for the records of `pairs`, without sequence nor cigar,
+        which is enough for links_from_reads and kario_from_reads
+        """
+        from vizuread import Read
+        for flag, pos, mapq, mate_pos in zip(
+            *(self.pairs(c1, c2, start1, end1)[name].tolist() for name in ("flag", "pos", "mapQ", "mate_pos"))
+        ) :
+            yield Read.from_fields(flag, c1, pos, mapq, "*", c2, mate_pos, "*", "*", keep_seq=False)
+
+    def __len__(self) -> int :
+        return len(self.records)
+
+    def __repr__(self) -> str:
+        return f"DiscordantIndex({self.path}, {len(self)} discordant reads)"
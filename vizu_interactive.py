@@ -0,0 +1,202 @@
+"""
+Interactive plots of a region, updated when the ax is zoomed or panned (eg in a notebook with `%matplotlib widget`)
+
+```py
+fig, ax = plt.subplots(figsize=(12,5))
+view = InteractiveRegion(ax, bam, "chr14:105,709,976-105,710,983", piling="compact")
+# panning to the right only fetches and draws the reads of the newly exposed positions
+```
+
+The reads are loaded by chunks of positions around the visible window (with a `margin` of the visible width on each side).
+New chunks are piled on the right or on the left of the rows already drawn (see vizu_layout.IncrementalPile),
+so the reads on screen never move, and chunks further than `keep` visible widths from the view are removed.
+Every read overlapping the loaded positions belongs to exactly one chunk : the first chunk loaded holds all the reads
+overlapping it, a chunk added on the right the reads starting in it, a chunk added on the left the reads ending in it.
+The reads of a removed chunk that still overlap the loaded positions (eg long reads) are moved to its neighbour.
+Reads are drawn as collections (like plot_region(render="collection")).
+"""
+
+import logging
+import math
+
+from vizu_cache import overlaps
+from vizu_coverage import COVERAGE_WIDTH
+from vizu_layout import IncrementalPile
+
+
+logger = logging.getLogger(__name__)
+
+
+class Chunk() :
+    """reads starting between start and end, with their rows and the collections drawing them"""
+    def __init__(self, start:int, end:int, reads:list, rows:list, artists:list) -> None:
+        self.start = start
+        self.end = end
+        self.reads = reads
+        self.rows = rows
+        self.artists = artists
+
+    def remove(self) :
+        for artist in self.artists :
+            artist.remove()
+        self.artists = []
+
+    def extend(self, reads:list, rows:list, artists:list) :
+        self.reads += reads
+        self.rows += rows
+        self.artists += artists
+
+    def __repr__(self) -> str:
+        return f"Chunk({self.start}-{self.end}, {len(self.reads)} reads)"
+
+
+class InteractiveRegion() :
+    """
+    Draws the reads of a region on an ax and keeps them up to date with its x limits, see the module docstring.
+    Nothing is fetched while the visible width is over `max_width` bp.
+    `samtools_command`, `samtools_options` and `cache` are passed to get_reads_from or to the vizu_cache.ReadCache,
+    kwargs to the collections.
+    """
+    def __init__(self, ax, bam_file, region, samtools_command="samtools", samtools_options="", piling="spaced",
+                 max_rows=None, margin:float=0.5, keep:float=2.0, max_width:int=COVERAGE_WIDTH, cache=None, **kwargs) -> None:
+        from vizuread import parse_region
+
+        self.ax = ax
+        self.bam_file = bam_file
+        self.chrom, start, end = parse_region(region)
+        if start is None :
+            raise ValueError("InteractiveRegion needs a region with a start and an end")
+        self.samtools_command = samtools_command
+        self.samtools_options = samtools_options
+        self.cache = cache
+        self.max_rows = max_rows
+        self.margin = margin
+        self.keep = keep
+        self.max_width = max_width
+        self.kwargs = kwargs
+
+        self.pile = IncrementalPile(piling)
+        self.chunks = []    # sorted by position, covering the contiguous positions self.start-self.end
+        self._updating = False
+
+        ax.set_xlim(start, end)
+        ax.set_autoscale_on(False)
+        self.update(start, end)
+        self.cid = ax.callbacks.connect("xlim_changed", self._on_xlim_changed)
+
+    @property
+    def start(self) :
+        return self.chunks[0].start if self.chunks else None
+
+    @property
+    def end(self) :
+        return self.chunks[-1].end if self.chunks else None
+
+    @property
+    def n_reads(self) -> int :
+        return sum(len(c.reads) for c in self.chunks)
+
+    def _on_xlim_changed(self, ax) :
+        if self._updating :
+            return
+        self.update(*ax.get_xlim())
+        ax.figure.canvas.draw_idle()
+
+    def update(self, view_start:float, view_end:float) :
+        """loads the chunks needed to show view_start-view_end and drops the ones too far from it"""
+        width = view_end - view_start
+        if width > self.max_width :
+            logger.info(f"Visible region wider than {self.max_width} bp, reads are not fetched")
+            return
+        want_start = max(1, math.floor(view_start - self.margin*width))
+        want_end = math.ceil(view_end + self.margin*width)
+
+        self._updating = True
+        try :
+            if self.chunks and (want_end < self.start or want_start > self.end) :
+                # jumped to another place, starting over instead of loading everything in between
+                for chunk in self.chunks :
+                    chunk.remove()
+                self.chunks = []
+                self.pile = IncrementalPile(self.pile.piling)
+            if not self.chunks :
+                self._add(want_start, want_end, right=True)
+            else :
+                if want_end > self.end :
+                    self._add(self.end+1, want_end, right=True)
+                if want_start < self.start :
+                    self._add(want_start, self.start-1, right=False)
+            self._drop(view_start - self.keep*width, view_end + self.keep*width)
+            self.ax.set_ylim(-1, max(self.pile.n_rows, 1))
+        finally :
+            self._updating = False
+
+    def _fetch(self, start:int, end:int, right:bool) -> list :
+        """reads of start-end that are not in a chunk yet, see the module docstring"""
+        from vizuread import get_reads_from
+        if self.cache is not None :
+            reads = self.cache.get_reads(
+                self.bam_file, (self.chrom, start, end), samtools_command=self.samtools_command,
+                samtools_options=self.samtools_options, keep_seq=False,
+            )
+        else :
+            reads = get_reads_from(
+                self.bam_file, (self.chrom, start, end), samtools_command=self.samtools_command,
+                samtools_options=self.samtools_options, keep_seq=False,
+            )
+        if not self.chunks :
+            return list(reads)
+        if right :
+            return [r for r in reads if start <= r.pos <= end]
+        return [r for r in reads if r.pos + max(r.ref_span, 1) - 1 <= end]
+
+    def _draw(self, reads:list, rows:list) -> list :
+        """draws the reads that have a row, returns the collections"""
+        from vizu_plot import plot_batch
+        placed = [(r, row) for r, row in zip(reads, rows) if row is not None]
+        if not placed :
+            return []
+        return plot_batch(self.ax, [r for r, _ in placed], [row for _, row in placed], **self.kwargs)
+
+    def _add(self, start:int, end:int, right:bool) :
+        reads = self._fetch(start, end, right)
+        starts, lengths = [r.start for r in reads], [r.plot_len for r in reads]
+        if right :
+            rows = self.pile.add_right(starts, lengths, self.max_rows)
+        else :
+            rows = self.pile.add_left(starts, lengths, self.max_rows)
+
+        chunk = Chunk(start, end, reads, rows, self._draw(reads, rows))
+        if right :
+            self.chunks.append(chunk)
+        else :
+            self.chunks.insert(0, chunk)
+
+    def _move_overlapping(self, dropped:Chunk, neighbour:Chunk) :
+        """removes a chunk, its reads still overlapping the positions of the other chunks being moved to `neighbour`"""
+        dropped.remove()
+        kept = [(r, row) for r, row in zip(dropped.reads, dropped.rows) if overlaps(r, self.start, self.end)]
+        if kept :
+            reads, rows = [r for r, _ in kept], [row for _, row in kept]
+            neighbour.extend(reads, rows, self._draw(reads, rows))
+
+    def _drop(self, keep_start:float, keep_end:float) :
+        """removes the chunks on the edges that are entirely outside keep_start-keep_end"""
+        dropped = False
+        while len(self.chunks) > 1 and self.chunks[0].end < keep_start :
+            self._move_overlapping(self.chunks.pop(0), self.chunks[0])
+            dropped = True
+        while len(self.chunks) > 1 and self.chunks[-1].start > keep_end :
+            self._move_overlapping(self.chunks.pop(), self.chunks[-1])
+            dropped = True
+        if dropped :
+            self.pile.rebuild(
+                (r.start, r.plot_len, row) for c in self.chunks for r, row in zip(c.reads, c.rows) if row is not None
+            )
+
+    def disconnect(self) :
+        """stops following the x limits of the ax"""
+        self.ax.callbacks.disconnect(self.cid)
+
+    def __repr__(self) -> str:
+        return f"InteractiveRegion({self.chrom}:{self.start}-{self.end}, {len(self.chunks)} chunks, {self.n_reads} reads)"
@@ -0,0 +1,180 @@
+"""
+Piling of the reads : computes on which row each read is drawn, independently of any plotting
+"""
+
+from dataclasses import dataclass
+from heapq import heapify, heappush, heappop
+
+
+READ_SPACING = 20
+PILINGS = [None, "compact", "seq", "spaced"]
+
+
+@dataclass
+class Layout() :
+    rows : list         # row of each read, None for the reads that could not be placed under the max_rows cap
+    n_rows : int        # number of rows used
+    n_dropped : int     # number of reads that were not placed
+
+    def placed(self, reads) :
+        """yields (read, row) for each read that was placed"""
+        for r, row in zip(reads, self.rows) :
+            if row is not None :
+                yield r, row
+
+
+def pile(starts, lengths, piling="spaced", max_rows=None) -> Layout :
+    """
+    Returns a Layout giving the row of each interval defined by its start and length.
+    The intervals are expected in the order they will be drawn, usually sorted by position like in a bam file.
+
+    The `piling` argument accepts :
+    - "compact" : an interval goes on the lowest row where it fits
+    - "spaced"  : same as compact, but with READ_SPACING of padding on the left and the right of each interval
+    - "seq"     : the intervals go back to the bottom row only if there is a break between them
+    - None      : each interval corresponds to a row
+
+    If `max_rows` is given, intervals that would need a row above the cap are not placed,
+    their row is None and they are counted in `Layout.n_dropped`.
+    """
+    if piling is None :
+        rows = list(range(len(starts)))
+    elif piling in {"compact", "spaced"} :
+        padding = READ_SPACING if piling == "spaced" else 0
+        rows = _first_fit(starts, lengths, padding, max_rows)
+    elif piling == "seq" :
+        rows = []
+        rightmost = 0
+        i = 0
+        for start, length in zip(starts, lengths) :
+            if start > rightmost :
+                i = 0
+            rows.append(i)
+            if start + length > rightmost :
+                rightmost = start + length
+            i += 1
+    else :
+        raise Exception("piling argument has to be one of [None, 'compact', 'seq', 'spaced']")
+
+    if max_rows is not None :
+        rows = [row if row is not None and row < max_rows else None for row in rows]
+
+    placed = [row for row in rows if row is not None]
+    return Layout(
+        rows=rows,
+        n_rows=max(placed)+1 if placed else 0,
+        n_dropped=len(rows)-len(placed),
+    )
+
+
+def layout_reads(reads, piling="spaced", max_rows=None) -> Layout :
+    """Returns the Layout of a list of Read objects, see `pile`"""
+    return pile([r.start for r in reads], [r.plot_len for r in reads], piling=piling, max_rows=max_rows)
+
+
+def _first_fit(starts, lengths, padding, max_rows, rightmosts=None) :
+    """
+    Puts each interval on the lowest row whose rightmost position + padding is before the start of the interval.
+
+    Rows that are still in use are kept in a heap sorted by their rightmost position, and are moved to a heap
+    of free rows sorted by row number once the sweep goes past them, so the lowest free row is found in O(log n).
+    Intervals going backwards (start lower than the furthest start seen) can't use the free rows as is,
+    for these ones every row is checked, which gives the exact same result as a plain first fit.
+
+    `rightmosts` gives the rightmost position of rows already in use (see IncrementalPile), it is updated in place.
+    """
+    rows = []
+    rightmosts = [] if rightmosts is None else rightmosts     # rightmost position of each row
+    busy = [(right_pos, row) for row, right_pos in enumerate(rightmosts)]   # heap of (rightmost, row) for the rows in use, may contain outdated entries
+    heapify(busy)
+    free = []           # heap of rows that are available for any start >= sweep
+    is_free = [False] * len(rightmosts)     # is_free[row] tells if the row is really in the free heap
+    sweep = None        # furthest start seen
+
+    for start, length in zip(starts, lengths) :
+        if sweep is None or start >= sweep :
+            sweep = start
+            while busy and busy[0][0] + padding < start :
+                right_pos, row = heappop(busy)
+                if rightmosts[row] == right_pos and not is_free[row] :
+                    is_free[row] = True
+                    heappush(free, row)
+            while free and not is_free[free[0]] :
+                heappop(free)
+            row = heappop(free) if free else None
+        else :
+            # the sweep went past this interval, falling back to checking every row
+            row = next((j for j, right_pos in enumerate(rightmosts) if right_pos + padding < start), None)
+
+        if row is None :
+            if max_rows is not None and len(rightmosts) >= max_rows :
+                rows.append(None)
+                continue
+            row = len(rightmosts)
+            rightmosts.append(start + length)
+            is_free.append(False)
+        else :
+            rightmosts[row] = start + length
+            is_free[row] = False
+
+        heappush(busy, (start + length, row))
+        rows.append(row)
+
+    return rows
+
+
+class IncrementalPile() :
+    """
+    Piling of intervals added on the right or on the left of the ones already placed, without moving these ones,
+    used to extend a plot when it is panned (see vizu_interactive.py). Only the "compact" and "spaced" pilings make sense here.
+    """
+    def __init__(self, piling="spaced") -> None:
+        if piling not in {"compact", "spaced"} :
+            raise Exception("piling argument has to be one of ['compact', 'spaced'] for an incremental piling")
+        self.piling = piling
+        self.padding = READ_SPACING if piling == "spaced" else 0
+        self.leftmost = []      # leftmost position of each row
+        self.rightmost = []     # rightmost position of each row
+
+    @property
+    def n_rows(self) -> int :
+        return len(self.rightmost)
+
+    def add_right(self, starts, lengths, max_rows=None) -> list :
+        """
+        Places intervals that are on the right of the ones already placed, sorted by start,
+        each one going on the lowest row ending before it. Returns their rows (None if over max_rows).
+        """
+        rows = _first_fit(starts, lengths, self.padding, max_rows, self.rightmost)
+        self.leftmost += [float("inf")] * (self.n_rows - len(self.leftmost))
+        for start, row in zip(starts, rows) :
+            if row is not None :
+                self.leftmost[row] = min(self.leftmost[row], start)
+        return rows
+
+    def add_left(self, starts, lengths, max_rows=None) -> list :
+        """
+        Places intervals that are on the left of the ones already placed, each one going on the lowest row
+        starting after it (going from right to left). Returns their rows in the order of the intervals given.
+        """
+        # the same first fit as add_right on the mirrored positions, the leftmost positions becoming rightmost ones
+        order = sorted(range(len(starts)), key=lambda i : starts[i] + lengths[i], reverse=True)
+        mirrored = [-left for left in self.leftmost]
+        placed = _first_fit([-(starts[i] + lengths[i]) for i in order], [lengths[i] for i in order], self.padding, max_rows, mirrored)
+        self.leftmost = [-left for left in mirrored]
+        self.rightmost += [float("-inf")] * (len(self.leftmost) - len(self.rightmost))
+
+        rows = [None] * len(starts)
+        for i, row in zip(order, placed) :
+            rows[i] = row
+            if row is not None :
+                self.rightmost[row] = max(self.rightmost[row], starts[i] + lengths[i])
+        return rows
+
+    def rebuild(self, placements) :
+        """resets the extent of the rows from the (start, length, row) of the intervals still placed, after some were removed"""
+        self.leftmost = [float("inf")] * self.n_rows
+        self.rightmost = [float("-inf")] * self.n_rows
+        for start, length, row in placements :
+            self.leftmost[row] = min(self.leftmost[row], start)
+            self.rightmost[row] = max(self.rightmost[row], start + length)
@@ -0,0 +1,468 @@
+"""
+Plotting layer of vizuread : reads, regions and coverage drawn on matplotlib axes
+
+```py
+from vizuread import get_reads_from         # core : reading, parsing and piling the reads
+from vizu_plot import plot_region           # plotting, matplotlib being imported on the first plot
+
+reads = [r for r in get_reads_from(bam, "chr14:105,709,976-105,710,983") if r.mapQ >= 20]
+plot_region(ax=ax, reads=reads)
+```
+
+vizuread doesn't import matplotlib, so that the scripts and workers only retrieving or filtering reads start fast.
+Here matplotlib is only imported inside the functions drawing something, and the MAPQ colours are looked up
+in tables built the first time a read is coloured. plot_region, plot_regions and plot_transloc can still be
+imported from vizuread, which loads this module on first access.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+import logging
+import time
+
+import numpy as np
+
+from vizu_bam import MAX_POS, BamFile, reference_lengths
+from vizu_coverage import COVERAGE_BINS, COVERAGE_WIDTH, MAX_READS, Coverage, DepthCap
+from vizu_layout import layout_reads, pile
+from vizu_readbatch import ReadBatch, load_reads
+from vizu_stats import Stats
+from vizuread import Read, _native_filters, get_reads_from, parse_region
+from vizu_regions import get_reads_from_regions
+
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def mapq_colormaps() :
+    """colormaps of the MAPQ of the properly paired reads and of the other ones"""
+    import matplotlib
+    return matplotlib.colormaps["Blues"].resampled(256), matplotlib.colormaps["Oranges"].resampled(256)
+
+
+@lru_cache(maxsize=None)
+def mapq_colors() -> tuple[list, list] :
+    """RGBA colour of each MAPQ (0 to 255) for the properly paired reads and for the other ones, built once"""
+    return tuple([tuple(color) for color in cmap(np.arange(256)).tolist()] for cmap in mapq_colormaps())
+
+
+# indels at least this long (in bp) are always drawn, even when smaller than min_pixels
+MIN_INDEL = 5
+# segments narrower than this (in pixels) are merged with their neighbours by plot_region
+MIN_PIXELS = 0.5
+
+def coalesce_segments(segments, min_length:float, min_indel:int=MIN_INDEL) :
+    """
+    Returns the segments of a cigar with the ones shorter than `min_length` bp merged with their neighbours,
+    so that long reads with hundreds of operations are drawn with about one segment per pixel.
+
+    Insertions and deletions shorter than both `min_length` and `min_indel` are not drawn : small deletions
+    become part of the surrounding match, small insertions are dropped. Small clips become matches too, 
+    and consecutive matches (including skipped regions, drawn the same way) are drawn as one segment.
+    """
+    coalesced = []
+    for operation, length in segments :
+        if operation in {"I", "D"} and (length >= min_length or length >= min_indel) :
+            coalesced.append((operation, length))
+            continue
+        if operation == "I" :
+            continue
+        if operation in {"S", "H"} and length >= min_length :
+            coalesced.append((operation, length))
+            continue
+        if coalesced and coalesced[-1][0] == "M" :
+            coalesced[-1] = ("M", coalesced[-1][1] + length)
+        else :
+            coalesced.append(("M", length))
+    return coalesced
+
+
+def read_arrows(read:Read, ypos:int, min_length:float=None) :
+    """
+    Yields the parameters of the arrows representing a read, one per segment of the cigar.
+    These are shared by the different renderers so that the reads look the same whatever the way they are drawn.
+    With `min_length`, the segments shorter than this (in bp) are merged, see `coalesce_segments`.
+    """
+    if hasattr(read, "color") : 
+        color = read.color
+    else :
+        properly_paired, other = mapq_colors()
+        color = (properly_paired if read.is_properly_paired else other)[read.mapQ]
+
+    cursor_pos = read.start
+
+    # defining colors and widths for the different types of segments
+    colors = {"H" : "black", "S" : "grey", "D" : "red", "I" : "green"}
+    widths = {"D" : 0.3, "I" : 0.9}
+
+    segments = read.segments if not min_length else coalesce_segments(read.segments, min_length)
+    for i, segment in enumerate(segments) :
+        operation, length = segment
+        # we use the MAPQ color only for "M" segments, aka matches
+        # for other segments, we use defined colors
+        s_color = colors.get(operation, color)
+        # same logic for the arrow width
+        width = widths.get(operation, 0.8)
+        head_width = width if operation != "D" else 0.3
+
+        # for insertions, we make sure they appear on top and we center them
+        if operation == "I" : 
+            z_order = 2 
+            drift = (length/2) if read.is_forward else (-length/2)
+        else : 
+            z_order = 1
+            drift = 0
+
+        if read.is_forward :
+            head_length = 4 if i+1 == len(segments) else 0 # tracing the arrow head only for the tip of the read
+            x, dx = cursor_pos+drift, length
+        else :
+            head_length = 4 if i==0 else 0 # tracing the arrow head only for the tip of the read
+            # for reverse reads, the position of clipped reads is shifted by Read._shift
+            x, dx = cursor_pos+length+drift, -length
+
+        yield dict(
+            x=x, y=ypos, dx=dx, dy=0, width=width, head_width=head_width, 
+            head_length=head_length, color=s_color, zorder=z_order,
+        )
+
+        # for insertions, the reference span stay the same
+        if operation != "I" : cursor_pos += length 
+
+
+def plot_read(ax, read:Read, ypos:int, min_length:float=None, **kwargs) :
+    """
+    Plots an arrow representing a read on a plt.ax at the given y position.
+    With `min_length`, the segments shorter than this (in bp) are merged, see `coalesce_segments`.
+    
+    Kwargs are passed to plt.arrow https://matplotlib.org/stable/api/_as_gen/matplotlib.pyplot.arrow.html 
+    """
+    for arrow in read_arrows(read, ypos, min_length) :
+        ax.arrow(length_includes_head=True, **arrow, **kwargs)
+
+
+def read_polygons(read:Read, ypos:int, min_length:float=None) :
+    """
+    Yields a (vertices, color, zorder) tuple for each segment of a read at the given y position.
+
+    The vertices are the same as the ones of the arrows drawn by `plot_read`, 
+    but they can be gathered in a few collections instead of being added to an ax one by one.
+    """
+    for a in read_arrows(read, ypos, min_length) :
+        if a["dx"] == 0 : continue # matplotlib displays nothing for an empty arrow
+        # same shape as a matplotlib FancyArrow with length_includes_head=True
+        tip = a["x"] + a["dx"]
+        sign = 1 if a["dx"] > 0 else -1
+        back = tip - sign*a["head_length"]
+        tail = a["x"]
+        hw, w = a["head_width"]/2, a["width"]/2
+        verts = [
+            (tip, ypos), (back, ypos-hw), (back, ypos-w), (tail, ypos-w),
+            (tail, ypos+w), (back, ypos+w), (back, ypos+hw), (tip, ypos),
+        ]
+        yield verts, a["color"], a["zorder"]
+
+
+def plot_batch(ax, reads:list[Read], ypositions:list[int], min_length:float=None, **kwargs) :
+    """
+    Plots many reads at once on a plt.ax, `ypositions` giving the y position of each read.
+
+    Instead of adding one arrow per segment, the segments of all the reads are gathered in one 
+    PolyCollection per z-order, which is way faster to draw and save for regions with a lot of reads.
+    With `min_length`, the segments shorter than this (in bp) are merged, see `coalesce_segments`.
+
+    Kwargs are passed to the PolyCollection https://matplotlib.org/stable/api/collections_api.html
+    """
+    import matplotlib
+    from matplotlib.collections import PolyCollection
+
+    groups = {} # zorder -> (vertices, colors)
+    for read, ypos in zip(reads, ypositions) :
+        for verts, color, zorder in read_polygons(read, ypos, min_length) :
+            group = groups.setdefault(zorder, ([], []))
+            group[0].append(verts)
+            group[1].append(color)
+
+    collections = []
+    for zorder, (verts, colors) in sorted(groups.items()) :
+        # facecolor and edgecolor are both set, like the `color` argument of plt.arrow does
+        collection = PolyCollection(
+            verts, facecolors=colors, edgecolors=colors, 
+            linewidths=matplotlib.rcParams["patch.linewidth"], zorder=zorder, 
+            **kwargs
+        )
+        ax.add_collection(collection)
+        collections.append(collection)
+    ax.autoscale_view()
+
+    return collections
+
+
+def plot_region(
+    bam_file:str=None, region:str=None, ax=None, 
+    reads=[], samtools_command="samtools", samtools_options="", 
+    piling="spaced", max_rows=None, render="arrows", cache=None, 
+    mode="auto", coverage_width=COVERAGE_WIDTH, max_reads=MAX_READS, bins=COVERAGE_BINS, max_depth=None, stats=None, 
+    min_pixels=MIN_PIXELS, **kwargs) :
+    """
+    Plots reads from a specific region on a matplotlib ax. Returns the list of Read objects.
+    
+    By default, the reads will be piled up with an algorithm trying to optimize the space they use on the plot.
+    This algorithm can be changed with the `piling` kwarg and accepts :
+    - "compact" : the reads will take the minimum amount of space possible
+    - "spaced"  : same as compact, but with some spacing on the left and the right of each read
+    - "seq"     : the reads are placed on the bottom of the graph again only if there is a break between the reads
+    - None      : each read corresponds to a line on the graph
+
+    The piling itself is done by `vizu_layout.layout_reads`, which can be used without plotting anything.
+    With `max_rows`, reads that would be placed above this number of rows are not plotted (a warning tells how many).
+
+    Big regions are drawn as a coverage histogram instead of reads, depending on the `mode` kwarg :
+    - "auto"     : coverage for regions wider than `coverage_width` bp or holding more than `max_reads` reads, reads otherwise
+    - "reads"    : always draws the reads
+    - "coverage" : always draws the coverage, split by strand and proper pairing, in `bins` bins (see vizu_coverage.py)
+    When the coverage is drawn, the vizu_coverage.Coverage object is returned instead of the reads.
+    With `max_depth`, reads are downsampled so that no position is covered by more than this number of reads.
+
+    The way the reads are drawn can be changed with the `render` kwarg : 
+    - "arrows"     : one matplotlib arrow is added per segment of each read
+    - "collection" : the segments of all the reads are gathered in a few collections, with the same look.
+      Much faster to draw and save when there are thousands of reads.
+    Cigar segments narrower than `min_pixels` pixels on the ax are merged with their neighbours (see coalesce_segments), 
+    so long reads with hundreds of operations cost about one segment per pixel. Indels of at least MIN_INDEL bp are always drawn.
+    With min_pixels=None, every segment is drawn.
+
+    A list of reads (or a vizu_readbatch.ReadBatch) can be directly passed. In that case, every other arguments except `ax` will be ignored.
+    `reads` can also be the path of a file written by vizu_readbatch.save_reads, which is memory-mapped instead of read.
+    This is useful if you wanna retrieve a list of reads and perform custom operations on them before plotting them. 
+
+    If samtools isn't in your path, you can overwrite the default samtools_command kwarg by an appropriate one.
+
+    You can filter reads by passing additional options to the samtools command. See `samtools view --help` for all available options. 
+    Options that make samtools write it's output to a file instead of stdout are to avoid.
+
+    Flags explanation for the -f, -F and -G options : https://broadinstitute.github.io/picard/explain-flags.html
+
+    A vizu_cache.ReadCache can be given with the `cache` kwarg so that repeated or overlapping regions 
+    are not retrieved from the bam file again.
+
+    A vizu_stats.Stats object can be given with the `stats` kwarg to record the time spent in each stage 
+    (fetch, parse, filter, layout, draw) and counters (reads, segments, rows, clipped reads). 
+    With stats=True, a new Stats object is created and a (reads, stats) tuple is returned.
+
+    Additional kwargs are passed to plt.arrow https://matplotlib.org/stable/api/_as_gen/matplotlib.pyplot.arrow.html 
+    (or to the PolyCollection when render="collection")
+
+    ```
+    # create sublots
+    fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(12,5))
+    # define regions
+    region1 = (chr1, 10000, 20000)      # define a tuple
+    region2 = "chr2:4587639-5789456"    # or use a string à la IGV
+    # plot the regions on the given axes
+    plot_region(bam_file, region1, ax[0])
+    plot_region(bam_file, region2, ax[1], samtools_options="-F 2") # use the flag -F 2 to exclude all reads that are properly paired.
+    # do some additional manipulations to your axes
+    ax[1].set_title("some title")
+    plt.show()
+    """
+
+    if ax is None : raise Exception("ax must be defined")
+    if mode not in {"auto", "reads", "coverage"} :
+        raise Exception("mode argument has to be one of ['auto', 'reads', 'coverage']")
+
+    if stats is True :
+        stats = Stats()
+        return plot_region(
+            bam_file, region, ax, reads, samtools_command, samtools_options, piling, max_rows, render, cache, 
+            mode, coverage_width, max_reads, bins, max_depth, stats, min_pixels, **kwargs
+        ), stats
+
+    if isinstance(reads, (str, Path)) :
+        reads = load_reads(reads)
+
+    chrom = start = end = None
+    if reads == [] :
+        if bam_file is None : raise Exception(f"bam_file must be defined")
+
+        chrom, start, end = parse_region(region)
+        if start is None and mode != "reads" and ":" not in chrom :
+            # whole chromosome
+            start, end = 1, reference_lengths(bam_file).get(chrom, MAX_POS)
+        if mode == "auto" and start is not None and end - start + 1 > coverage_width :
+            mode = "coverage"
+
+        filters = _native_filters(bam_file, chrom, samtools_options, "auto") if mode == "coverage" and cache is None else None
+        if filters is not None :
+            # only the position, span and flag of each record are decoded, no Read is built
+            with BamFile(bam_file) as bam :
+                spans = bam.spans(chrom, start, end, **filters)
+                if stats is not None :
+                    spans = stats.timed(spans, "fetch")
+                coverage = Coverage(chrom, start, end, bins=bins).add_spans(spans)
+            if stats is not None :
+                stats.count("reads", coverage.n_reads)
+            coverage.plot(ax)
+            return coverage
+
+        if cache is not None :
+            source = cache.get_reads(bam_file, region, samtools_command=samtools_command, samtools_options=samtools_options, stats=stats)
+        else :
+            # the generator is consumed one read at a time, which keeps the memory bounded for the coverage
+            source = get_reads_from(
+                bam_file, region, samtools_command=samtools_command, samtools_options=samtools_options,
+                keep_seq=mode != "coverage", stats=stats,
+            )
+    else :
+        if not isinstance(reads, (list, ReadBatch)) :
+            # any iterable of reads, eg the generator of get_reads_from, is consumed once into a list
+            reads = list(reads)
+        source = reads
+        if mode != "reads" and len(reads) > 0 and isinstance(reads, ReadBatch) :
+            # from the columns, without building a Read per read
+            chrom = reads.names[reads.chr_code[0]]
+            start = int(reads.pos.min())
+            end = int((reads.pos + np.maximum(reads.ref_span, 1) - 1).max())
+        elif mode != "reads" and len(reads) > 0 :
+            chrom = reads[0].chr
+            start = min(r.pos for r in reads)
+            end = max(r.pos + max(r.ref_span, 1) - 1 for r in reads)
+
+    if isinstance(source, ReadBatch) and mode == "auto" and max_depth is None and len(source) > max_reads :
+        logger.info(f"More than {max_reads} reads, plotting the coverage instead")
+        mode = "coverage"
+    if mode == "coverage" :
+        coverage = Coverage(chrom, start, end, bins=bins).add_reads(source)
+        coverage.plot(ax)
+        return coverage
+
+    if isinstance(source, list) and max_depth is None and (mode == "reads" or len(source) <= max_reads) :
+        reads = source
+    elif isinstance(source, ReadBatch) and max_depth is None and (mode == "reads" or len(source) <= max_reads) :
+        reads = source
+    else :
+        # consuming the reads one at a time, downsampling them and switching to coverage if there are too many
+        cap = DepthCap(max_depth) if max_depth is not None else None
+        reads = []
+        source = iter(source)
+        filtering = 0.0
+        for r in source :
+            if cap is not None :
+                tick = time.perf_counter()
+                accepted = cap.accept_read(r)
+                filtering += time.perf_counter() - tick
+                if not accepted : continue
+            reads.append(r)
+            if mode == "auto" and len(reads) > max_reads :
+                logger.info(f"More than {max_reads} reads, plotting the coverage instead")
+                coverage = Coverage(chrom, start, end, bins=bins).add_reads(reads).add_reads(source)
+                coverage.plot(ax)
+                return coverage
+        if cap is not None and cap.n_dropped > 0 :
+            logger.warning(f"{cap.n_dropped} reads were not plotted, the maximum depth of {max_depth} was reached")
+        if stats is not None :
+            stats.add_time("filter", filtering)
+            if cap is not None : stats.count("filtered", cap.n_dropped)
+
+    tick = time.perf_counter()
+    if isinstance(reads, ReadBatch) :
+        layout = pile(reads.start.tolist(), reads.plot_len.tolist(), piling=piling, max_rows=max_rows)
+    else :
+        layout = layout_reads(reads, piling=piling, max_rows=max_rows)
+    if layout.n_dropped > 0 :
+        logger.warning(f"{layout.n_dropped} reads were not plotted, the cap of {max_rows} rows was reached")
+    placements = list(layout.placed(reads))
+    if stats is not None :
+        stats.add_time("layout", time.perf_counter() - tick)
+        stats.count("rows", layout.n_rows)
+
+    tick = time.perf_counter()
+    min_length = None
+    if min_pixels and placements :
+        # bp per pixel of the ax, for the region asked or the span of the reads
+        if start is not None :
+            width = end - start + 1
+        else :
+            width = max(r.start + r.plot_len for r, _ in placements) - min(r.start for r, _ in placements)
+        min_length = min_pixels * width / max(ax.get_window_extent().width, 1)
+
+    if render == "arrows" :
+        for r, ypos in placements :
+            plot_read(ax, r, ypos, min_length=min_length, **kwargs)
+    elif render == "collection" :
+        plot_batch(ax, [r for r, _ in placements], [ypos for _, ypos in placements], min_length=min_length, **kwargs)
+    else :
+        raise Exception("render argument has to be one of ['arrows', 'collection']")
+    if stats is not None :
+        stats.add_time("draw", time.perf_counter() - tick)
+        for r, _ in placements :
+            stats.count("segments", len(r.segments if not min_length else coalesce_segments(r.segments, min_length)))
+            if r.segments and (r.segments[0][0] in {"S", "H"} or r.segments[-1][0] in {"S", "H"}) :
+                stats.count("clipped")
+
+    return reads
+
+def plot_regions(bam_file, regions, axes=None, save_to:str=None, figsize=(12,5), samtools_command="samtools", samtools_options="", stats=None, **kwargs) -> dict :
+    """
+    Plots many regions (a list of positions or a BED file), their reads being retrieved in one pass over the bam file 
+    (see get_reads_from and vizu_regions.py). Returns the dict {(chrom, start, end) : list of reads}.
+
+    The regions are drawn either :
+    - on `axes`, one ax per region in the order of the regions
+    - in one figure per region of size `figsize` saved to `save_to`, a path formatted with the chrom, start and end 
+      of the region, eg "plots/{chrom}_{start}_{end}.png"
+    - in a new figure with one row per region otherwise
+
+    Kwargs are passed to plot_region (piling, render, mode...).
+    """
+    import matplotlib.pyplot as plt
+
+    reads = get_reads_from_regions(
+        bam_file, regions, samtools_command=samtools_command, samtools_options=samtools_options, stats=stats,
+    )
+
+    if save_to is None and axes is None :
+        _, axes = plt.subplots(nrows=len(reads), ncols=1, figsize=(figsize[0], figsize[1]*len(reads)), squeeze=False)
+    if axes is not None :
+        axes = list(np.ravel(axes))
+        if len(axes) < len(reads) :
+            raise ValueError(f"{len(reads)} regions to plot on {len(axes)} axes")
+
+    for i, ((chrom, start, end), region_reads) in enumerate(reads.items()) :
+        if save_to is not None :
+            fig, ax = plt.subplots(figsize=figsize)
+        else :
+            ax = axes[i]
+        if region_reads :
+            plot_region(ax=ax, reads=region_reads, stats=stats, **kwargs)
+        if start is not None :
+            ax.set_xlim(start, end+1)
+        ax.set_title(chrom if start is None else f"{chrom}:{start}-{end}")
+        if save_to is not None :
+            fig.savefig(save_to.format(chrom=chrom, start=start, end=end))
+            plt.close(fig)
+
+    return reads
+
+
+def plot_transloc(
+    f = "T30989_realigned.fixed.recal.bam",
+    c1 = "chr11",
+    c2 = "chr14",
+    s = "69,638,162",
+    e = "69,639,433"
+    ) :
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(12,5))
+    reads = plot_region(f, (c1, s, e), ax[0], samtools_options="-F 2")
+    p = [r.pos_receiver for r in reads if r.receiver_chr == c2]
+    mi, ma = min(p), max(p)
+
+    reads2 = get_reads_from(f, c2, mi, ma, flags="-F 2")
+    plot_region(ax=ax[1], reads=reads2)
+    ax[0].set_title(f"Reads {c1}")
+    ax[1].set_title(f"Reads {c2}")    
+    plt.suptitle(f"Reads attestant d'une translocation {c1}-{c2}")
+    plt.show()
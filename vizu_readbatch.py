@@ -0,0 +1,273 @@
+"""
+Columnar storage of reads : a ReadBatch holds the fields of many reads as numpy arrays
+instead of one Read object per read, which takes a lot less memory for big regions or whole chromosomes.
+
+```py
+batch = ReadBatch.from_bam(bam, "chr14", samtools_options="-F 2")
+batch = batch[batch.mate_chr == "chr11"]    # vectorised filtering
+plot_region(reads=batch, ax=ax)             # accepted like a list of reads
+first_read = batch[0]                       # Read objects are built on demand
+save_reads(batch, "discordant.vzr")         # written once...
+plot_region(reads="discordant.vzr", ax=ax)  # ...and memory-mapped by every later use
+```
+
+File layout of save_reads : magic, length of the JSON header (uint32), JSON header, then the arrays of the batch
+one after the other, each one starting on a multiple of 8 bytes. The header gives the chromosome names
+(the chr and mate_chr arrays holding indices in this list, like in a ReadBatch) and the type, offset and length of each array.
+"""
+
+from array import array
+from pathlib import Path
+import json
+import os
+import struct
+
+import numpy as np
+
+
+CIGAR_OPS = "MIDNSHP=X"
+_CIGAR_CODES = {op : code for code, op in enumerate(CIGAR_OPS)}
+
+# columns holding one value per read, with the numpy type used to store them.
+# Chromosomes are stored as indices in the names of the batch, decoded by the chr and mate_chr properties
+COLUMNS = {
+    "flag" : np.uint16,
+    "chr_code" : np.int32,
+    "pos" : np.int64,
+    "mapQ" : np.uint8,
+    "mate_chr_code" : np.int32,
+    "mate_pos" : np.int64,
+    "start" : np.int64,
+    "end" : np.int64,
+    "plot_len" : np.int64,
+    "length" : np.int64,
+    "is_forward" : np.bool_,
+    "is_properly_paired" : np.bool_,
+}
+
+
+def _gather(values:np.ndarray, offsets:np.ndarray, idx:np.ndarray) :
+    """returns the variable length items number `idx` of a flat array, and the offsets of the new flat array"""
+    lengths = offsets[idx+1] - offsets[idx]
+    new_offsets = np.zeros(len(idx)+1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    positions = np.repeat(offsets[idx] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return values[positions], new_offsets
+
+
+class ReadBatch():
+    """
+    Struct-of-arrays representation of a list of reads.
+
+    Every name of COLUMNS is an attribute holding a numpy array with one value per read.
+    The chromosome of each read and of its mate are indices in the `names` list ("=" and "*" included),
+    `chr` and `mate_chr` return them as arrays of names, built on each access. The cigars are stored as flat arrays of operations (index in CIGAR_OPS) and lengths,
+    read i owning the items cigar_offsets[i]:cigar_offsets[i+1]. Sequences and qualities are
+    stored the same way as bytes when the batch is built with keep_seq=True, otherwise seq and qual are None.
+    """
+    def __init__(self, columns:dict, names:list, cigar_ops, cigar_lens, cigar_offsets, seq=None, seq_offsets=None, qual=None, qual_offsets=None) -> None:
+        for name in COLUMNS :
+            setattr(self, name, columns[name])
+        self.names = names
+        self.cigar_ops = cigar_ops
+        self.cigar_lens = cigar_lens
+        self.cigar_offsets = cigar_offsets
+        self.seq = seq
+        self.seq_offsets = seq_offsets
+        self.qual = qual
+        self.qual_offsets = qual_offsets
+
+    @classmethod
+    def from_reads(cls, reads, keep_seq=False) -> "ReadBatch" :
+        """
+        Builds a batch from an iterable of Read objects. The iterable is consumed one read at a time,
+        so passing the generator returned by get_reads_from never keeps more than one Read in memory.
+        """
+        values = {name : array("q") for name in COLUMNS}
+        codes = {}  # chromosome name -> index in the names of the batch
+        cigar_ops, cigar_lens, cigar_offsets = array("B"), array("q"), array("q", [0])
+        seq, seq_offsets, qual, qual_offsets = bytearray(), array("q", [0]), bytearray(), array("q", [0])
+
+        for r in reads :
+            values["flag"].append(r.flag)
+            values["chr_code"].append(codes.setdefault(r.chr, len(codes)))
+            values["pos"].append(r.pos)
+            values["mapQ"].append(r.mapQ)
+            values["mate_chr_code"].append(codes.setdefault(r.receiver_chr, len(codes)))
+            values["mate_pos"].append(r.pos_receiver)
+            values["start"].append(r.start)
+            values["end"].append(r.end)
+            values["plot_len"].append(r.plot_len)
+            values["length"].append(r.length)
+            values["is_forward"].append(r.is_forward)
+            values["is_properly_paired"].append(r.is_properly_paired)
+
+            for operation, length in r.segments :
+                cigar_ops.append(_CIGAR_CODES[operation])
+                cigar_lens.append(length)
+            cigar_offsets.append(len(cigar_ops))
+
+            if keep_seq :
+                seq += r.seq.encode()
+                seq_offsets.append(len(seq))
+                qual += r.qual.encode()
+                qual_offsets.append(len(qual))
+
+        columns = {name : np.frombuffer(values[name], dtype=np.int64).astype(dtype) for name, dtype in COLUMNS.items()}
+        if keep_seq :
+            seqs = dict(
+                seq=np.frombuffer(bytes(seq), dtype=np.uint8), seq_offsets=np.frombuffer(seq_offsets, dtype=np.int64),
+                qual=np.frombuffer(bytes(qual), dtype=np.uint8), qual_offsets=np.frombuffer(qual_offsets, dtype=np.int64),
+            )
+        else :
+            seqs = {}
+        return cls(
+            columns, list(codes), np.frombuffer(cigar_ops, dtype=np.uint8), np.frombuffer(cigar_lens, dtype=np.int64).astype(np.uint32),
+            np.frombuffer(cigar_offsets, dtype=np.int64), **seqs
+        )
+
+    @classmethod
+    def from_bam(cls, bam_file, position, keep_seq=False, **kwargs) -> "ReadBatch" :
+        """Builds a batch from a region of a bam file, kwargs are passed to get_reads_from"""
+        from vizuread import get_reads_from
+        return cls.from_reads(get_reads_from(bam_file, position, keep_seq=keep_seq, **kwargs), keep_seq=keep_seq)
+
+    def __len__(self) -> int :
+        return len(self.flag)
+
+    def __getitem__(self, key) :
+        """
+        batch[i] returns a Read, batch[mask], batch[indices] or batch[start:stop] return a new ReadBatch
+        """
+        if isinstance(key, (int, np.integer)) :
+            return self.read(int(key))
+
+        idx = np.arange(len(self))[key]
+        columns = {name : getattr(self, name)[idx] for name in COLUMNS}
+        cigar_ops, cigar_offsets = _gather(self.cigar_ops, self.cigar_offsets, idx)
+        cigar_lens, _ = _gather(self.cigar_lens, self.cigar_offsets, idx)
+        seqs = {}
+        if self.seq is not None :
+            seqs["seq"], seqs["seq_offsets"] = _gather(self.seq, self.seq_offsets, idx)
+            seqs["qual"], seqs["qual_offsets"] = _gather(self.qual, self.qual_offsets, idx)
+        return ReadBatch(columns, self.names, cigar_ops, cigar_lens, cigar_offsets, **seqs)
+
+    def __iter__(self) :
+        for i in range(len(self)) :
+            yield self.read(i)
+
+    def cigar(self, i:int) -> str :
+        """returns the cigar string of the read number i"""
+        a, b = self.cigar_offsets[i], self.cigar_offsets[i+1]
+        return "".join(
+            f"{length}{CIGAR_OPS[op]}" for op, length in zip(self.cigar_ops[a:b].tolist(), self.cigar_lens[a:b].tolist())
+        ) or "*"
+
+    def read(self, i:int) :
+        """returns a Read object for the read number i"""
+        from vizuread import Read
+        if self.seq is not None :
+            seq = self.seq[self.seq_offsets[i]:self.seq_offsets[i+1]].tobytes().decode()
+            qual = self.qual[self.qual_offsets[i]:self.qual_offsets[i+1]].tobytes().decode()
+        else :
+            seq, qual = "*", "*"
+        return Read.from_fields(
+            int(self.flag[i]), self.names[self.chr_code[i]], int(self.pos[i]), int(self.mapQ[i]), self.cigar(i),
+            self.names[self.mate_chr_code[i]], int(self.mate_pos[i]), seq, qual, length=int(self.length[i]),
+            keep_seq=self.seq is not None,
+        )
+
+    def _decode(self, codes:np.ndarray) -> np.ndarray :
+        return np.array(self.names, dtype=str)[codes] if self.names else np.array([], dtype=str)
+
+    @property
+    def chr(self) -> np.ndarray :
+        """chromosome of each read"""
+        return self._decode(self.chr_code)
+
+    @property
+    def mate_chr(self) -> np.ndarray :
+        """chromosome of the mate of each read, "=" for the chromosome of the read"""
+        return self._decode(self.mate_chr_code)
+
+    @property
+    def ref_span(self) -> np.ndarray :
+        """reference positions covered by each read (its M, D and N operations), like Read.ref_span"""
+        counted = np.isin(self.cigar_ops, [_CIGAR_CODES[op] for op in "MDN"])
+        spans = np.concatenate([[0], np.cumsum(np.where(counted, self.cigar_lens, 0), dtype=np.int64)])
+        return spans[self.cigar_offsets[1:]] - spans[self.cigar_offsets[:-1]]
+
+    @property
+    def nbytes(self) -> int :
+        """memory used by the arrays of the batch"""
+        arrays = [getattr(self, name) for name in COLUMNS]
+        arrays += [self.cigar_ops, self.cigar_lens, self.cigar_offsets]
+        if self.seq is not None :
+            arrays += [self.seq, self.seq_offsets, self.qual, self.qual_offsets]
+        return sum(a.nbytes for a in arrays)
+
+    def __repr__(self) -> str:
+        return f"ReadBatch({len(self)} reads, {self.nbytes} bytes)"
+
+
+MAGIC = b"VZRB\x01"
+# names of the arrays in the files for the columns named differently in a ReadBatch
+_FILE_ARRAYS = {"chr_code" : "chr", "mate_chr_code" : "mate_chr"}
+
+
+def save_reads(reads, path, keep_seq=False) -> Path :
+    """
+    Writes reads (a ReadBatch or an iterable of Read objects) to a columnar binary file that load_reads memory-maps.
+    With keep_seq=True, the sequences and qualities are saved too (only if the reads still have them).
+    Returns the path of the file.
+    """
+    path = Path(path)
+    batch = reads if isinstance(reads, ReadBatch) else ReadBatch.from_reads(reads, keep_seq=keep_seq)
+
+    arrays = {_FILE_ARRAYS.get(name, name) : np.ascontiguousarray(getattr(batch, name)) for name in COLUMNS}
+    arrays["cigar_ops"], arrays["cigar_lens"], arrays["cigar_offsets"] = batch.cigar_ops, batch.cigar_lens, batch.cigar_offsets
+    if keep_seq and batch.seq is not None :
+        for name in ("seq", "seq_offsets", "qual", "qual_offsets") :
+            arrays[name] = getattr(batch, name)
+
+    layout, offset = {}, 0
+    for name, values in arrays.items() :
+        layout[name] = [values.dtype.str, offset, len(values)]
+        offset += -(-values.nbytes // 8) * 8
+    header = json.dumps({"n_reads" : len(batch), "names" : list(batch.names), "arrays" : layout}).encode()
+    padding = -(len(MAGIC) + 4 + len(header)) % 8
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as fp :
+        fp.write(MAGIC)
+        fp.write(struct.pack("<I", len(header) + padding))
+        fp.write(header + b" " * padding)
+        for values in arrays.values() :
+            data = np.ascontiguousarray(values).tobytes()
+            fp.write(data + b"\x00" * (-len(data) % 8))
+    os.replace(tmp, path)
+    return path
+
+
+def load_reads(path) -> ReadBatch :
+    """
+    Returns the ReadBatch saved by save_reads. The arrays, chromosome codes included, are views on the memory-mapped file.
+    """
+    path = Path(path)
+    with open(path, "rb") as fp :
+        if fp.read(len(MAGIC)) != MAGIC :
+            raise ValueError(f"{path} is not a file written by save_reads")
+        header_length, = struct.unpack("<I", fp.read(4))
+        header = json.loads(fp.read(header_length))
+
+    data_offset = len(MAGIC) + 4 + header_length
+    size = os.path.getsize(path) - data_offset
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=data_offset, shape=(size,)) if size else np.empty(0, dtype=np.uint8)
+    arrays = {}
+    for name, (dtype, offset, count) in header["arrays"].items() :
+        dtype = np.dtype(dtype)
+        arrays[name] = data[offset:offset + count*dtype.itemsize].view(dtype)
+
+    columns = {name : arrays[_FILE_ARRAYS.get(name, name)] for name in COLUMNS}
+    seqs = {name : arrays[name] for name in ("seq", "seq_offsets", "qual", "qual_offsets") if name in arrays}
+    return ReadBatch(columns, header["names"], arrays["cigar_ops"], arrays["cigar_lens"], arrays["cigar_offsets"], **seqs)
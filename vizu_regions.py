@@ -0,0 +1,156 @@
+"""
+Retrieval of many regions of a bam file in one pass, eg the regions of a panel
+
+```py
+regions = read_bed("panel.bed")
+reads = get_reads_from(bam, regions)            # or get_reads_from(bam, "panel.bed")
+for (chrom, start, end), region_reads in reads.items() :
+    ...
+plot_regions(bam, "panel.bed", save_to="plots/{chrom}_{start}_{end}.png")
+```
+
+Overlapping regions are merged and the merged intervals are read in the order of the bam file,
+with one `samtools view -M` for all of them (or one open bam file for the native reader).
+Each read is then given to every requested region it overlaps.
+"""
+
+from bisect import bisect_right
+from pathlib import Path
+import gzip
+import shlex
+
+from vizu_bam import MAX_POS, BamFile, find_index, parse_filters
+from vizu_cache import overlaps
+
+
+BED_SUFFIXES = (".bed", ".bed.gz")
+
+
+def read_bed(path) -> list[tuple[str, int, int]] :
+    """
+    Returns the regions of a BED file as (chrom, start, end) tuples, 1-based and inclusive like samtools regions
+    (BED intervals are 0-based, end excluded). Header, track and comment lines are skipped.
+    """
+    opener = gzip.open if str(path).endswith(".gz") else open
+    regions = []
+    with opener(path, "rt") as fp :
+        for line in fp :
+            if not line.strip() or line.startswith(("#", "track", "browser")) :
+                continue
+            fields = line.split("\t") if "\t" in line else line.split()
+            if len(fields) < 3 :
+                raise ValueError(f"Less than 3 columns in a line of {path} : {line!r}")
+            regions.append((fields[0], int(fields[1]) + 1, int(fields[2])))
+    return regions
+
+
+def is_region_list(position) -> bool :
+    """tells a list of regions (or a BED file) from a single position given as a string or a tuple/list of 3 elements"""
+    if isinstance(position, Path) :
+        return True
+    if isinstance(position, str) :
+        return position.endswith(BED_SUFFIXES)
+    if isinstance(position, (tuple, list)) :
+        if len(position) != 3 or any(isinstance(p, (tuple, list)) for p in position) :
+            return True
+        # (chrom, start, end) has a number as its second element
+        try :
+            int(str(position[1]).replace(",", "").replace(" ", ""))
+            return False
+        except ValueError :
+            return True
+    return True
+
+
+def parse_regions(regions) -> list[tuple[str, int, int]] :
+    """
+    Returns the (chrom, start, end) tuples of a list of positions (see vizuread.parse_region) or of a BED file,
+    without duplicates and in the order they were given. Whole chromosomes have None as start and end.
+    """
+    from vizuread import parse_region
+    if isinstance(regions, (str, Path)) :
+        regions = read_bed(regions)
+    return list(dict.fromkeys(parse_region(r) for r in regions))
+
+
+def merge_regions(regions:list[tuple[str, int, int]]) -> list[tuple[str, int, int, list]] :
+    """
+    Merges the overlapping and adjacent regions, returns (chrom, start, end, regions) tuples sorted by chromosome and position,
+    `regions` being the requested regions inside each merged interval
+    """
+    by_chrom = {}
+    for region in regions :
+        by_chrom.setdefault(region[0], []).append(region)
+
+    merged = []
+    for chrom, chrom_regions in sorted(by_chrom.items()) :
+        chrom_regions.sort(key=lambda r : (r[1] or 1, r[2] or MAX_POS))
+        for region in chrom_regions :
+            start, end = region[1] or 1, region[2] or MAX_POS
+            if merged and merged[-1][0] == chrom and start <= merged[-1][2] + 1 :
+                _, m_start, m_end, members = merged[-1]
+                merged[-1] = (chrom, m_start, max(m_end, end), members + [region])
+            else :
+                merged.append((chrom, start, end, [region]))
+    return merged
+
+
+def _demultiplex(read, members:list, results:dict) :
+    for region in members :
+        if region[1] is None or overlaps(read, region[1], region[2]) :
+            results[region].append(read)
+
+
+def get_reads_from_regions(bam_file, regions, samtools_command="samtools", samtools_options="", backend="auto", keep_seq=True, mate_chrom=None, stats=None) -> dict :
+    """
+    Returns a dict {(chrom, start, end) : list of reads} for a list of regions or a BED file, see the module docstring.
+    Keys are in the order of the regions given, the other arguments are the ones of vizuread.get_reads_from.
+    A read overlapping several regions is in the list of each of them.
+    """
+    from vizuread import Read, _parse, _samtools_reads
+
+    requested = parse_regions(regions)
+    results = {region : [] for region in requested}
+    merged = merge_regions(requested)
+    if not merged :
+        return results
+
+    if backend not in {"auto", "native", "samtools"} :
+        raise Exception("backend argument has to be one of ['auto', 'native', 'samtools']")
+    filters = parse_filters(samtools_options)
+    native_possible = filters is not None and find_index(bam_file) is not None and not any(":" in m[0] for m in merged)
+
+    if backend == "native" or (backend == "auto" and native_possible) :
+        if filters is None :
+            raise Exception(f"samtools options '{samtools_options}' can't be applied by the native backend, only -f, -F and -q are supported")
+        with BamFile(bam_file) as bam :
+            # reading the intervals in the order of the file
+            merged.sort(key=lambda m : (bam.tids.get(m[0], -1), m[1]))
+            for chrom, start, end, members in merged :
+                records = bam.fetch(chrom, start, end, mate_chrom=mate_chrom, keep_seq=keep_seq, **filters)
+                for read in _parse(records, lambda fields : Read.from_fields(*fields, keep_seq=keep_seq), stats) :
+                    _demultiplex(read, members, results)
+        return results
+
+    # -M : a read overlapping several intervals is written only once
+    intervals = [f"{chrom}:{start}-{end}" for chrom, start, end, _ in merged]
+    args = [*shlex.split(samtools_command), "view", "-M", *shlex.split(samtools_options), str(bam_file), *intervals]
+
+    by_chrom = {}   # chrom -> (starts, ends, members) of its merged intervals, sorted
+    for chrom, start, end, members in merged :
+        starts, ends, chrom_members = by_chrom.setdefault(chrom, ([], [], []))
+        starts.append(start)
+        ends.append(end)
+        chrom_members.append(members)
+
+    for read in _samtools_reads(args, keep_seq, mate_chrom, stats) :
+        if read.chr not in by_chrom :
+            continue
+        starts, ends, chrom_members = by_chrom[read.chr]
+        read_end = read.pos + max(read.ref_span, 1) - 1
+        # merged intervals don't overlap, so their ends are sorted too
+        i = bisect_right(starts, read_end) - 1
+        while i >= 0 and ends[i] >= read.pos :
+            _demultiplex(read, chrom_members[i], results)
+            i -= 1
+    return results
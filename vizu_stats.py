@@ -0,0 +1,85 @@
+"""
+Opt-in instrumentation of get_reads_from and plot_region : time spent in each stage and counters
+
+```py
+stats = Stats()
+plot_region(bam, "chr14:105,709,976-105,710,983", ax=ax, stats=stats)
+print(stats)
+```
+
+The stages are :
+- fetch  : reading the bam file, or waiting for the output of samtools
+- parse  : creating the Read objects
+- filter : downsampling (max_depth), the mate chromosome being filtered while fetching
+- layout : piling the reads
+- draw   : adding the reads to the ax
+
+A callback can be given, it is called with (stage, seconds) every time some time is added to a stage.
+Reads are timed in bulk, so the callback is called once per stage of a region, not once per read.
+"""
+
+from contextlib import contextmanager
+import time
+
+
+STAGES = ["fetch", "parse", "filter", "layout", "draw"]
+# reads : reads retrieved from the bam file, filtered : reads dropped by the downsampling,
+# segments / rows / clipped : segments drawn, rows used and reads starting or ending with a clip
+COUNTERS = ["reads", "filtered", "segments", "rows", "clipped"]
+
+
+class Stats() :
+    """wall time per stage (in seconds) and counters, accumulated over every call it is given to"""
+    def __init__(self, callback=None) -> None:
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.callback = callback
+
+    def add_time(self, stage:str, seconds:float) :
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        if self.callback is not None :
+            self.callback(stage, seconds)
+
+    def count(self, name:str, n:int=1) :
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name:str) :
+        """times the body of a `with` block as part of a stage"""
+        start = time.perf_counter()
+        try :
+            yield self
+        finally :
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, iterable, stage:str) :
+        """yields the items of an iterable, the time spent getting them being added to a stage once it is done"""
+        elapsed = 0.0
+        iterator = iter(iterable)
+        try :
+            while True :
+                start = time.perf_counter()
+                try :
+                    item = next(iterator)
+                except StopIteration :
+                    break
+                finally :
+                    elapsed += time.perf_counter() - start
+                yield item
+        finally :
+            self.add_time(stage, elapsed)
+
+    @property
+    def total(self) -> float :
+        return sum(self.seconds.values())
+
+    def to_dict(self) -> dict :
+        return {"seconds" : dict(self.seconds), "counts" : dict(self.counts)}
+
+    def __str__(self) -> str:
+        times = ", ".join(f"{stage}={seconds:.3f}s" for stage, seconds in self.seconds.items())
+        counts = ", ".join(f"{name}={n}" for name, n in self.counts.items())
+        return f"{times} ; {counts}"
+
+    def __repr__(self) -> str:
+        return f"Stats({self})"
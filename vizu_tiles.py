@@ -0,0 +1,270 @@
+"""
+Pre-rendered PNG tiles of a bam file at several zoom levels, for browsing the same bams again and again
+
+```py
+tiles = TileStore("file.bam", samtools_options="-q 10", piling="compact")
+tiles.draw(ax, "chr14", 105_700_000, 105_720_000)   # composes the tiles, rendered only the first time
+serve(tiles, port=8000)                             # GET /tiles/chr14/3/13213.png
+```
+
+Tiles of level z are TILE_WIDTH * 2**z bp wide, tile i of a chromosome covering the positions
+i*width+1 to (i+1)*width. Fine levels show the reads, coarse levels the coverage (see vizu_coverage.py).
+Every tile of a level shares the same y scale so that they can be put side by side.
+
+The reads are piled on windows of LAYOUT_WIDTH bp aligned on the chromosome, the same piling being used by every
+tile inside a window whatever its level, so that a read crossing the border of two tiles is on the same row in both.
+Reads crossing the border of two windows are piled once per window and may still be on different rows on each side.
+
+Tiles are saved as PNG files in a directory per bam file (path, modification time and size) and options,
+the least recently used ones being deleted once the directory goes over `max_bytes`.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+
+
+# width in bp of the tiles of level 0
+TILE_WIDTH = 1000
+# tiles wider than this show the coverage instead of the reads
+READS_MAX_WIDTH = 16_000
+MAX_LEVEL = 20
+TILE_PIXELS = (512, 256)
+TILE_ROWS = 60          # rows of reads shown in a tile, reads above are not drawn
+DEPTH_SCALE = 100       # the coverage tiles show depths from -DEPTH_SCALE to DEPTH_SCALE
+# width of the windows the reads are piled on, a multiple of the width of every tile showing reads
+LAYOUT_WIDTH = READS_MAX_WIDTH
+LAYOUT_CACHE = 4        # pilings of windows kept in memory for the next tiles
+CACHE_DIR = Path.home() / ".cache" / "vizuread" / "tiles"
+# changed whenever the rendering changes, so that the tiles already on disk are not served anymore
+# 2 : coverage tiles with the reads spread over every bin they cover
+# 3 : reads piled per layout window instead of per tile
+TILE_VERSION = 3
+
+logger = logging.getLogger(__name__)
+
+
+class TileStore() :
+    """
+    Renders the tiles of a bam file and keeps them on disk, see the module docstring.
+    `samtools_command` and `samtools_options` are passed to get_reads_from, `piling` to plot_region.
+    """
+    def __init__(self, bam_file, cache_dir=CACHE_DIR, samtools_command="samtools", samtools_options="", piling="spaced",
+                 max_bytes:int=1_000_000_000, tile_pixels=TILE_PIXELS, dpi:int=100, rows:int=TILE_ROWS, depth_scale:float=DEPTH_SCALE) -> None:
+        self.bam_file = bam_file
+        self.samtools_command = samtools_command
+        self.samtools_options = samtools_options
+        self.piling = piling
+        self.max_bytes = max_bytes
+        self.tile_pixels = tuple(tile_pixels)
+        self.dpi = dpi
+        self.rows = rows
+        self.depth_scale = depth_scale
+
+        self.cache_dir = Path(cache_dir)
+        self.path = self.cache_dir / self.key()
+        self.lock = threading.Lock()
+        self.layouts = OrderedDict()    # (chrom, window) -> (read, row) of its placed reads, least recently used first
+        # the size is shared by every store of the cache directory, each one evicting in the whole directory
+        self.size = sum(f.stat().st_size for f in self.cache_dir.rglob("*.png")) if self.cache_dir.exists() else 0
+
+    def key(self) -> str :
+        """name of the directory of the tiles, changing with the bam file and with anything changing the look of the tiles"""
+        stat = os.stat(self.bam_file)
+        identity = [
+            TILE_VERSION, os.path.abspath(self.bam_file), stat.st_mtime_ns, stat.st_size, self.samtools_options, self.piling,
+            self.tile_pixels, self.dpi, self.rows, self.depth_scale,
+        ]
+        return hashlib.sha1(json.dumps(identity).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def tile_width(level:int) -> int :
+        return TILE_WIDTH << level
+
+    def level_for(self, start:int, end:int, pixels:float) -> int :
+        """returns the level whose resolution (bp per pixel) is the closest to showing start-end on `pixels` pixels, without going under it"""
+        bp_per_pixel = (end - start + 1) / max(pixels, 1)
+        level = math.ceil(math.log2(max(bp_per_pixel * self.tile_pixels[0] / TILE_WIDTH, 1)))
+        return min(level, MAX_LEVEL)
+
+    def tile_path(self, chrom:str, level:int, index:int) -> Path :
+        return self.path / chrom / str(level) / f"{index}.png"
+
+    def tile(self, chrom:str, level:int, index:int) -> Path :
+        """
+        returns the path of a tile, rendering it if it isn't cached yet. The file can be evicted by later tiles,
+        tile_png gives the content of a tile safely
+        """
+        with self.lock :
+            self._tile_png(chrom, level, index)
+        return self.tile_path(chrom, level, index)
+
+    def tile_png(self, chrom:str, level:int, index:int) -> bytes :
+        """returns a tile as PNG bytes, rendering it if it isn't cached yet"""
+        with self.lock :
+            return self._tile_png(chrom, level, index)
+
+    def _tile_png(self, chrom:str, level:int, index:int) -> bytes :
+        # called with the lock held, so that the tiles of this store aren't evicted while they are read
+        if not 0 <= level <= MAX_LEVEL or index < 0 :
+            raise ValueError(f"No tile {index} at level {level}, levels go from 0 to {MAX_LEVEL}")
+        path = self.tile_path(chrom, level, index)
+        try :
+            # the modification time gives the least recently used tiles
+            os.utime(path)
+            return path.read_bytes()
+        except FileNotFoundError :
+            # not rendered yet, or evicted by another store of the cache directory
+            pass
+
+        png = self.render(chrom, level, index)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(png)
+        os.replace(tmp, path)
+        self.size += len(png)
+        self.evict()
+        return png
+
+    def layout(self, chrom:str, window:int) -> list :
+        """returns the (read, row) of the reads placed in a layout window (LAYOUT_WIDTH bp), piled the first time"""
+        from vizu_layout import layout_reads
+        from vizuread import get_reads_from
+
+        key = (chrom, window)
+        if key in self.layouts :
+            self.layouts.move_to_end(key)
+            return self.layouts[key]
+        reads = list(get_reads_from(
+            self.bam_file, (chrom, window*LAYOUT_WIDTH + 1, (window+1)*LAYOUT_WIDTH), samtools_command=self.samtools_command,
+            samtools_options=self.samtools_options, keep_seq=False,
+        ))
+        placements = list(layout_reads(reads, piling=self.piling, max_rows=self.rows).placed(reads))
+        self.layouts[key] = placements
+        while len(self.layouts) > LAYOUT_CACHE :
+            self.layouts.popitem(last=False)
+        return placements
+
+    def render(self, chrom:str, level:int, index:int) -> bytes :
+        """renders a tile as PNG bytes, without going through pyplot"""
+        from matplotlib.figure import Figure
+        from vizu_plot import MIN_PIXELS, plot_batch, plot_region
+
+        width = self.tile_width(level)
+        start, end = index*width + 1, (index+1)*width
+        fig = Figure(figsize=(self.tile_pixels[0]/self.dpi, self.tile_pixels[1]/self.dpi), dpi=self.dpi)
+        ax = fig.add_axes((0, 0, 1, 1))
+
+        if width > READS_MAX_WIDTH :
+            plot_region(
+                self.bam_file, (chrom, start, end), ax, samtools_command=self.samtools_command,
+                samtools_options=self.samtools_options, mode="coverage", bins=self.tile_pixels[0],
+            )
+            ax.set_ylim(-self.depth_scale, self.depth_scale)
+        else :
+            # the tile is inside one layout window, its reads keep the rows they have in the whole window
+            placements = [
+                (r, row) for r, row in self.layout(chrom, (start-1) // LAYOUT_WIDTH)
+                if min(r.start, r.start + r.plot_len) <= end+1 and max(r.start, r.start + r.plot_len) >= start
+            ]
+            if placements :
+                # segments narrower than MIN_PIXELS pixels are merged, like plot_region does
+                plot_batch(
+                    ax, [r for r, _ in placements], [row for _, row in placements],
+                    min_length=MIN_PIXELS * width / self.tile_pixels[0],
+                )
+            ax.set_ylim(-1, self.rows)
+
+        ax.set_xlim(start, end+1)
+        ax.set_axis_off()
+        buffer = BytesIO()
+        fig.savefig(buffer, format="png")
+        return buffer.getvalue()
+
+    def evict(self) :
+        """deletes the least recently used tiles of the cache directory until it fits in max_bytes"""
+        if self.size <= self.max_bytes :
+            return
+        tiles = []
+        for f in self.cache_dir.rglob("*.png") :
+            try :
+                stat = f.stat()
+            except FileNotFoundError :
+                # deleted by another store of the cache directory in the meantime
+                continue
+            tiles.append((stat.st_mtime_ns, stat.st_size, f))
+        tiles.sort(key=lambda t : t[0])
+        self.size = sum(size for _, size, _ in tiles)
+        for _, size, f in tiles :
+            if self.size <= self.max_bytes :
+                break
+            f.unlink(missing_ok=True)
+            self.size -= size
+
+    def draw(self, ax, chrom:str, start:int, end:int, level:int=None) :
+        """
+        Composes the tiles covering chrom:start-end on a plt.ax, returns the images added to it.
+        By default the level is chosen from the width of the ax in pixels.
+        """
+        from matplotlib.image import imread
+
+        if level is None :
+            level = self.level_for(start, end, ax.get_window_extent().width)
+        width = self.tile_width(level)
+        images = []
+        for index in range((start-1) // width, (end-1) // width + 1) :
+            image = imread(BytesIO(self.tile_png(chrom, level, index)))
+            images.append(ax.imshow(
+                image, extent=(index*width + 1, (index+1)*width + 1, 0, 1), aspect="auto", interpolation="nearest",
+            ))
+        ax.set_xlim(start, end+1)
+        ax.set_ylim(0, 1)
+        ax.set_yticks([])
+        return images
+
+    def __repr__(self) -> str:
+        return f"TileStore({self.bam_file}, {self.path}, {self.size}/{self.max_bytes} bytes)"
+
+
+def serve(store:TileStore, host:str="127.0.0.1", port:int=8000) :
+    """
+    Serves the tiles of a store over HTTP until interrupted, at /tiles/{chrom}/{level}/{index}.png
+    """
+    tile_regex = re.compile(r"/tiles/(?P<chrom>[^/]+)/(?P<level>\d+)/(?P<index>\d+)\.png")
+
+    class TileHandler(BaseHTTPRequestHandler) :
+        def do_GET(self) :
+            match = tile_regex.fullmatch(self.path.split("?")[0])
+            if match is None :
+                self.send_error(404, "Tiles are at /tiles/{chrom}/{level}/{index}.png")
+                return
+            try :
+                png = store.tile_png(match["chrom"], int(match["level"]), int(match["index"]))
+            except Exception as e :
+                logger.error(f"Tile {self.path} failed : {type(e).__name__}: {e}")
+                self.send_error(500, f"{type(e).__name__}: {e}")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(png)))
+            self.send_header("Cache-Control", "max-age=3600")
+            self.end_headers()
+            self.wfile.write(png)
+
+        def log_message(self, format, *args) :
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), TileHandler)
+    logger.info(f"Serving the tiles of {store.bam_file} on http://{host}:{server.server_port}/tiles/")
+    try :
+        server.serve_forever()
+    finally :
+        server.server_close()
@@ -2,13 +2,19 @@
 Script de création de graphes de translocation
 """
 
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 import logging
 
 from matplotlib import pyplot as plt
+import numpy as np
 
-from vizuread import Read, get_reads_from, plot_region
+from vizu_circos import CircosWriter
+from vizu_index import DiscordantIndex
+from vizu_plot import plot_region
+from vizuread import Read, get_reads_from
 
 
 
@@ -42,6 +48,22 @@ class Link() :
         return f"{self.c1}\t{self.p1}\t{self.p1}\t{self.c2}\t{self.p2}\t{self.p2}\tclass={self.col}\n"
 
 
+def get_discordant_reads(bam, region, mate_chrom:str, samtools_command="samtools", samtools_options="-F 2", cache=None) -> list[Read] :
+    """
+    Returns the list of reads of a region whose mate is mapped on `mate_chrom`. 
+    The mate filter is applied on the raw records so the other reads are never parsed.
+    With a vizu_cache.ReadCache, the region is retrieved through the cache and the reads are filtered afterwards.
+    """
+    if cache is not None :
+        reads = cache.get_reads(bam, region, samtools_command=samtools_command, samtools_options=samtools_options)
+        # same filter as get_reads_from(mate_chrom=...), "=" being a mate on the chromosome of the read
+        return [r for r in reads if r.receiver_chr == mate_chrom or (r.receiver_chr == "=" and r.chr == mate_chrom)]
+
+    return list(get_reads_from(
+        bam, region, samtools_command=samtools_command, samtools_options=samtools_options, mate_chrom=mate_chrom
+    ))
+
+
 @dataclass
 class Transloc() :
     f : Path
@@ -51,62 +73,177 @@ class Transloc() :
     c2 : str
     start2 : int
     end2 : int
+    samtools_command : str = "samtools"
 
-    def get_reads(self, padding=0, samtools_options="-F 2") :
-        reads1 = get_reads_from(self.f, (self.c1, int(self.start1)-padding, int(self.end1)+padding), samtools_command="satmools", samtools_options=samtools_options)
-        reads2 = get_reads_from(self.f, (self.c2, int(self.start2)-padding, int(self.end2)+padding), samtools_command="satmools", samtools_options=samtools_options)
-        
-        reads1 = [r for r in reads1 if r.receiver_chr == self.c2]
-        reads2 = [r for r in reads2 if r.receiver_chr == self.c1]
+    def get_reads(self, padding=0, samtools_options="-F 2", cache=None) :
+        """
+        Returns the reads of both sides whose mate is on the other side, the two regions being fetched concurrently
+        (one after the other with a vizu_cache.ReadCache, whose queries are answered one at a time anyway)
+        """
+        region1 = (self.c1, int(self.start1)-padding, int(self.end1)+padding)
+        region2 = (self.c2, int(self.start2)-padding, int(self.end2)+padding)
+        kwargs = dict(samtools_command=self.samtools_command, samtools_options=samtools_options, cache=cache)
 
-        return reads1, reads2
+        if cache is not None :
+            return (
+                get_discordant_reads(self.f, region1, self.c2, **kwargs),
+                get_discordant_reads(self.f, region2, self.c1, **kwargs),
+            )
+        with ThreadPoolExecutor(max_workers=2) as pool :
+            reads1 = pool.submit(get_discordant_reads, self.f, region1, self.c2, **kwargs)
+            reads2 = pool.submit(get_discordant_reads, self.f, region2, self.c1, **kwargs)
+            return reads1.result(), reads2.result()
 
-    def plot(self, save_to=""):
-        fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(12,5))
+    def support(self, index) -> tuple[int, int] :
+        """
+        Returns the number of reads of each side whose mate is on the other side, 
+        counted from a vizu_index.DiscordantIndex without reading the bam
+        """
+        pairs1 = index.pairs(self.c1, self.c2, self.start1, self.end1)
+        pairs2 = index.pairs(self.c2, self.c1, self.start2, self.end2)
+        in2 = (pairs1["mate_pos"] >= int(self.start2)) & (pairs1["mate_pos"] <= int(self.end2))
+        in1 = (pairs2["mate_pos"] >= int(self.start1)) & (pairs2["mate_pos"] <= int(self.end1))
+        return int(in2.sum()), int(in1.sum())
 
+    def plot(self, save_to=""):
+        """
+        Plots the reads of both sides of the translocation, shows the figure or saves it to `save_to`.
+        Returns False if there weren't enough reads to plot anything.
+        """
         reads1, reads2 = self.get_reads()
 
         if len(reads1) == 0 or len(reads2) == 0 :
             logging.error(f"Pas assez de reads retrouvés pour {self.f}")
-            return
+            return False
+
+        fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(12,5))
 
         plot_region(ax=ax[0], reads=reads1)
         plot_region(ax=ax[1], reads=reads2)
         
         ax[0].set_title(f"{self.c1}:{format_big_number(self.start1)}-{format_big_number(self.end1)}")
         ax[1].set_title(f"{self.c2}:{format_big_number(self.start2)}-{format_big_number(self.end2)}")
-        plt.suptitle(f"Patient : {self.f.name.split('_')[0]}")
+        fig.suptitle(f"Patient : {Path(self.f).name.split('_')[0]}")
         if save_to == "" :
             plt.show()
-            plt.close()
-            plt.cla()
         else :
-            plt.savefig(save_to)
-            plt.close()
-            plt.cla()
-
-def links_from_reads(r1:list[Read], r2:list[Read], file_path:Path|str) :
-    links = [
-        Link(r.chr, r.pos, r.receiver_chr, r.pos_receiver, r.is_forward)
-        for r in r1
+            fig.savefig(save_to)
+        plt.close(fig)
+        return True
+
+@dataclass
+class Candidate() :
+    transloc : Transloc
+    support : int       # number of distinct discordant pairs in the cluster
+
+    def __str__(self) -> str:
+        t = self.transloc
+        return f"{t.c1}:{t.start1}-{t.end1} {t.c2}:{t.start2}-{t.end2} ({self.support} pairs)"
+
+
+def cluster_pairs(c1:str, c2:str, pos1, pos2, bam, window=1000, min_support=2) -> list[Candidate] :
+    """
+    Groups the discordant pairs between c1 and c2 (positions on c1 and on c2 of each pair) whose positions 
+    are within `window` bp of each other on both sides. Returns a Candidate for each group of at least `min_support` pairs.
+
+    Pairs are sorted on their c1 position, then swept : a pair joins an open cluster if the cluster still spans
+    at most `window` bp on both sides with it, clusters being closed once the sweep is `window` bp past their first pair.
+    Pairs spread regularly over a long stretch thus make several candidates instead of chaining into one.
+    Identical pairs (a read and its mate) are counted once.
+    """
+    order = np.lexsort((pos2, pos1))
+    pos1, pos2 = np.asarray(pos1)[order].tolist(), np.asarray(pos2)[order].tolist()
+
+    done = []
+    active = [] # clusters as [min1, max1, min2, max2, support]
+    previous = None
+    for p1, p2 in zip(pos1, pos2) :
+        if (p1, p2) == previous :
+            continue
+        previous = (p1, p2)
+
+        still_active = []
+        for cluster in active :
+            (done if cluster[0] + window < p1 else still_active).append(cluster)
+        active = still_active
+
+        for cluster in active :
+            if cluster[3] - window <= p2 <= cluster[2] + window :
+                cluster[1] = p1
+                cluster[2], cluster[3] = min(cluster[2], p2), max(cluster[3], p2)
+                cluster[4] += 1
+                break
+        else :
+            active.append([p1, p1, p2, p2, 1])
+
+    return [
+        Candidate(Transloc(bam, c1, min1, max1, c2, min2, max2), support)
+        for min1, max1, min2, max2, support in done + active
+        if support >= min_support
     ]
-    with open(file_path, "w+") as fp :
-        for l in links :
-            fp.write(l.to_string())
 
-def kario_from_reads(reads:list[Read], file_path):
-    c1 = reads[0].chr
-    positions1 = [r.pos for r in reads]
-    min1, max1 = min(positions1), max(positions1)
-    c2 = reads[0].receiver_chr
-    positions2 = [r.pos_receiver for r in reads]
-    min2, max2 = min(positions2), max(positions2)
 
-    with open(file_path, "w+") as fp :
-        fp.write(f"chr - {c1} {c1.replace('chr', '')} {min1-200} {max1+200} {c1}\n")
-        fp.write(f"chr - {c2} {c2.replace('chr', '')} {min2-200} {max2+200} {c2}\n")
+def cluster_breakpoints(reads, bam, window=1000, min_support=2) -> list[Candidate] :
+    """
+    Returns candidate translocations, sorted by decreasing support, from an iterable of discordant reads 
+    (reads with a mate on another chromosome, eg from `get_reads_from(bam, "chr14", samtools_options="-F 2")`).
+    Reads of every chromosome pair are clustered in one pass, see `cluster_pairs`.
+
+    ```py
+    for candidate in cluster_breakpoints(DiscordantIndex.open(bam).reads("chr14", "chr11"), bam)[:5] :
+        candidate.transloc.plot(save_to=f"{candidate}.png")
+    ```
+    """
+    positions = {} # (c1, c2) -> (positions on c1, positions on c2), with c1 < c2 so that mates fall in the same pair
+    for r in reads :
+        if r.receiver_chr in {"=", "*", r.chr} :
+            continue
+        if r.chr < r.receiver_chr :
+            key, p1, p2 = (r.chr, r.receiver_chr), r.pos, r.pos_receiver
+        else :
+            key, p1, p2 = (r.receiver_chr, r.chr), r.pos_receiver, r.pos
+        pos1, pos2 = positions.setdefault(key, (array("q"), array("q")))
+        pos1.append(p1)
+        pos2.append(p2)
+
+    return _rank([
+        candidate
+        for (c1, c2), (pos1, pos2) in positions.items()
+        for candidate in cluster_pairs(c1, c2, np.frombuffer(pos1, dtype=np.int64), np.frombuffer(pos2, dtype=np.int64), bam, window, min_support)
+    ])
+
+
+def candidates_from_index(index, bam, window=1000, min_support=2) -> list[Candidate] :
+    """Same as `cluster_breakpoints`, for all the pairs of a vizu_index.DiscordantIndex"""
+    candidates = []
+    for c1, c2 in sorted({tuple(sorted(pair)) for pair in index.chromosome_pairs()}) :
+        # both directions of the pair, the mates of c2 being seen from c1
+        pairs12, pairs21 = index.pairs(c1, c2), index.pairs(c2, c1)
+        pos1 = np.concatenate([pairs12["pos"], pairs21["mate_pos"]])
+        pos2 = np.concatenate([pairs12["mate_pos"], pairs21["pos"]])
+        candidates += cluster_pairs(c1, c2, pos1, pos2, bam, window, min_support)
+    return _rank(candidates)
 
 
+def _rank(candidates:list[Candidate]) -> list[Candidate] :
+    return sorted(candidates, key=lambda c : c.support, reverse=True)
+
+
+def links_from_reads(r1:list[Read], r2:list[Read], file_path:Path|str, bin_size:int=None) :
+    """
+    Writes the circos links of the reads of r1 (any iterable of reads, consumed one at a time, eg `DiscordantIndex.reads`,
+    a ReadBatch or the path of a file written by vizu_readbatch.save_reads). See vizu_circos.CircosWriter for `bin_size`.
+    """
+    with CircosWriter(links=file_path, bin_size=bin_size) as circos :
+        circos.add_reads(r1)
+
+def kario_from_reads(reads:list[Read], file_path):
+    """
+    Writes the circos karyotype of the chromosomes of the reads and of their mates, whatever their number,
+    the reads being given like for links_from_reads
+    """
+    with CircosWriter(karyotype=file_path) as circos :
+        circos.add_reads(reads)
 
 
 if __name__ == "__main__" :
@@ -117,11 +254,12 @@ if __name__ == "__main__" :
     nom = "T32886"
     bam = f"/home/luka/Projet/routine/hebdo/{nom}_realigned.fixed.recal.bam"
 
-    reads1 = get_reads_from(bam, position="chr14", samtools_options="-F 2")
-    reads1 = [r for r in reads1 if r.receiver_chr == "chr11"]
-    
-    reads2 = get_reads_from(bam, position="chr11", samtools_options="-F 2")
-    reads2 = [r for r in reads2 if r.receiver_chr == "chr14"]
+    # the discordant pairs index gives where the chr14-chr11 reads are without scanning the chromosomes
+    index = DiscordantIndex.open(bam)
+    pairs1, pairs2 = index.pairs("chr14", "chr11"), index.pairs("chr11", "chr14")
+
+    reads1 = get_discordant_reads(bam, ("chr14", int(pairs1["pos"].min()), int(pairs1["pos"].max())), "chr11")
+    reads2 = get_discordant_reads(bam, ("chr11", int(pairs2["pos"].min()), int(pairs2["pos"].max())), "chr14")
 
     fig, axes = plt.subplots(1, 2, figsize=(10,5))
 
@@ -130,5 +268,5 @@ if __name__ == "__main__" :
 
     plt.show()
 
-    # links_from_reads(reads1, reads2, Path(f"circos/links/{nom}.links.txt"))                
+    # links_from_reads(index.reads("chr14", "chr11"), [], Path(f"circos/links/{nom}.links.txt"))                
     # kario_from_reads(reads1, Path(f"circos/links/{nom}.links.kario"))
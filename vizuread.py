@@ -1,23 +1,26 @@
+from collections import deque
+from functools import lru_cache
 import re
-from statistics import mean
+import shlex
 import subprocess as sp
-import matplotlib.pyplot as plt
-from matplotlib import cm
+import threading
+import time
+
+from vizu_bam import BamFile, find_index, parse_filters
+from vizu_layout import READ_SPACING, Layout, layout_reads, pile
+from vizu_regions import get_reads_from_regions, is_region_list
 
 import logging
 import re
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
-# logging.basicConfig(level=logging.DEBUG, format='[%(levelname)s] [%(asctime)s] [%(module)s] %(message)s', datefmt='%H:%M:%S')
-formatter = logging.Formatter('[%(levelname)s] [%(asctime)s] [%(module)s] %(message)s', datefmt='%H:%M:%S')
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-ch.setFormatter(formatter)
 
-logger.addHandler(ch)
+# size of the buffer used to read the output of samtools
+SAMTOOLS_BUFFER = 1024 * 1024
+# last lines written by samtools on stderr that are kept to be shown in the errors
+STDERR_LINES = 100
 
 
 class ReadException(Exception):
@@ -32,58 +35,82 @@ class EmptyEntry(ReadException):
 class BadCigar(ReadException) :
     """raised when the cigar string could not be parsed"""
 
-MAPQ_COLORS_PROPERLY_PAIRED = cm.get_cmap("Blues", 256)
-MAPQ_COLORS = cm.get_cmap("Oranges", 256)
-READ_SPACING = 20
+class SamtoolsError(Exception) :
+    """raised when samtools exits with an error"""
 
-def get_mean_qual(seq: str):
-    """returns the mean quality of a phred Q string"""
-    scores = [ord(c)-33 for c in seq]
-    return round(mean(scores), 1)
+def get_mean_qual(seq):
+    """returns the mean quality of a phred Q string (str or bytes)"""
+    if isinstance(seq, str) :
+        seq = seq.encode("ascii")
+    # summing the bytes is done in C, no need to go through every character in python
+    return round((sum(seq) - 33*len(seq)) / len(seq), 1)
 
 def is_forward(flags:int):
     """returns if a read is forward or reverse based on the presence of the x10 flag in the SAM flags"""
-    s = [ # crée une liste de 12 ints (0 ou 1) qui correspondent chacun à un flag
-        int(_) for _ in 
-        list(reversed(format(flags, "b").rjust(12, "0")))
-    ]
-    # le 5ème bit correspond au flag "read reverse strand"
-    return s[4] == 0
+    return not flags & 0x10
+
+CIGAR_REGEX = re.compile(r"(\d+)(\w)")
+# short-read cigars repeat a lot and are parsed once each, but long-read cigars are nearly all unique
+# and hold thousands of operations : only the cigars shorter than CACHED_CIGAR_LENGTH characters are cached
+CIGAR_CACHE = 16384
+CACHED_CIGAR_LENGTH = 64
+ADDS_TO_REF_SPAN = {
+    "M" : True,
+    "I" : False,
+    "D" : True,
+    "N" : True,
+    "S" : False,
+    "H" : False,
+}
 
 def parse_cigar(cigar:str) :
-    """returns a list of segments to be plotted as arrows"""
-    matches = re.findall(r"(\d+)(\w)", cigar)
+    """
+    returns the tuple of segments to be plotted as arrows, the reference span and the plotted length of a cigar.
+    Results of the short cigars are cached, the segments are a tuple so that they can't be modified by mistake.
+    """
+    if len(cigar) < CACHED_CIGAR_LENGTH :
+        return _parse_cigar_cached(cigar)
+    return _parse_cigar_uncached(cigar)
+
+def _parse_cigar_uncached(cigar:str) :
+    matches = CIGAR_REGEX.findall(cigar)
     if len(matches) == 0 and cigar != "*" :
         raise BadCigar(f"cigar '{cigar}' could not be parsed")
-    
-    adds_to_ref_span = {
-        "M" : True,
-        "I" : False,
-        "D" : True,
-        "N" : True,
-        "S" : False,
-        "H" : False,
-    }
+
     segments = []
     reff_span = 0
     plot_length = 0
-    for i, match in enumerate(matches) :
-        length, operation = int(match[0]), match[1]
+    for length, operation in matches :
+        length = int(length)
 
-        if adds_to_ref_span[operation] :
+        if ADDS_TO_REF_SPAN[operation] :
             reff_span += length
 
         if operation != "I" :
             plot_length += length
 
         segments.append((operation, length))
-    return segments, reff_span, plot_length
+    return tuple(segments), reff_span, plot_length
+
+_parse_cigar_cached = lru_cache(maxsize=CIGAR_CACHE)(_parse_cigar_uncached)
 
 class Read():
     """
     Class for a read extracted with samtools
+
+    The attributes that take time to compute (mean_qual, segments, ref_span, plot_len, start, end)
+    are only computed the first time they are accessed, so reads that are filtered out on their 
+    flag or mate chromosome cost almost nothing. With keep_seq=False, seq and qual are not kept 
+    (they are None, as well as mean_qual), which saves most of the memory taken by a read.
     """
-    def __init__(self, e:str) -> None:
+    __slots__ = (
+        "flag", "chr", "pos", "mapQ", "cigar", "receiver_chr", "pos_receiver", "seq", "qual",
+        "length", "is_forward", "is_properly_paired",
+        "_mean_qual", "_segments", "_ref_span", "_plot_len", "_start", "_end",
+        "__dict__", # custom attributes can still be set on a read, eg a color
+    )
+
+    def __init__(self, e:str, keep_seq:bool=True) -> None:
         """
         Initialize a Read object from a line obtained with the command `samtools view file.bam | cut -f 2,3,4,5,6,7,8,10,11`
         """
@@ -112,26 +139,134 @@ class Read():
                 f"Could not convert one of the following to an integer : {infos}\nRead : '{e}'"
             )
 
-        self.length = len(self.seq)
-        self.mean_qual = get_mean_qual(self.qual)
+        self._derive(keep_seq=keep_seq)
+
+    @classmethod
+    def from_fields(cls, flag:int, chr:str, pos:int, mapQ:int, cigar:str, receiver_chr:str, pos_receiver:int, seq:str, qual:str, length:int=None, keep_seq:bool=True) -> "Read" :
+        """
+        Initialize a Read object from already parsed fields, in the same order as in `Read.__init__`.
+        Used by the readers that don't go through the text output of samtools.
+        `length` overrides the length of the read when the sequence isn't available.
+        """
+        read = cls.__new__(cls)
+        read.flag = flag
+        read.chr = chr
+        read.pos = pos
+        read.mapQ = mapQ
+        read.cigar = cigar
+        read.receiver_chr = receiver_chr
+        read.pos_receiver = pos_receiver
+        read.seq = seq
+        read.qual = qual
+        read._derive(length, keep_seq)
+        return read
+
+    @classmethod
+    def from_sam(cls, line, keep_seq:bool=True) -> "Read" :
+        """
+        Initialize a Read object from a complete line of the output of `samtools view` (no need for `cut`).
+        The line can be bytes, in which case only the fields that are kept are decoded.
+        """
+        if isinstance(line, bytes) :
+            return cls._from_sam_bytes(line, keep_seq)
+        fields = line.rstrip("\n").split("\t", 11)
+        if len(fields) == 1 and fields[0].strip() == "" :
+            raise EmptyEntry()
+        if len(fields) < 11 :
+            raise MalformedEntry(f"Unexpected number of fields in a sam line (got {len(fields)}, expected at least 11) : \n{line}")
+        try :
+            return cls.from_fields(
+                int(fields[1]), fields[2], int(fields[3]), int(fields[4]), fields[5],
+                fields[6], int(fields[7]), fields[9], fields[10], keep_seq=keep_seq,
+            )
+        except ValueError :
+            infos = f"flag={fields[1]}, pos={fields[3]}, mapQ={fields[4]}, pos_mate={fields[7]}"
+            raise MalformedEntry(
+                f"Could not convert one of the following to an integer : {infos}\nRead : '{line}'"
+            )
+
+    @classmethod
+    def _from_sam_bytes(cls, line:bytes, keep_seq:bool=True) -> "Read" :
+        fields = line.rstrip(b"\n").split(b"\t", 11)
+        if len(fields) == 1 and fields[0].strip() == b"" :
+            raise EmptyEntry()
+        if len(fields) < 11 :
+            raise MalformedEntry(f"Unexpected number of fields in a sam line (got {len(fields)}, expected at least 11) : \n{line}")
+        try :
+            # int() parses bytes directly
+            return cls.from_fields(
+                int(fields[1]), _name(fields[2]), int(fields[3]), int(fields[4]), fields[5].decode(),
+                _name(fields[6]), int(fields[7]),
+                fields[9].decode() if keep_seq else None, fields[10].decode() if keep_seq else None,
+                length=len(fields[9]), keep_seq=keep_seq,
+            )
+        except ValueError :
+            infos = f"flag={fields[1]}, pos={fields[3]}, mapQ={fields[4]}, pos_mate={fields[7]}"
+            raise MalformedEntry(
+                f"Could not convert one of the following to an integer : {infos}\nRead : '{line}'"
+            )
+
+    def _derive(self, length:int=None, keep_seq:bool=True) :
+        """sets the cheap attributes derived from the fields of the read, the other ones are computed on access"""
+        self.length = len(self.seq) if length is None else length
         self.is_forward = is_forward(self.flag)
         self.is_properly_paired = (self.receiver_chr == "=")
 
-        self.segments, self.ref_span, self.plot_len = parse_cigar(self.cigar)
+        self._mean_qual = None
+        self._segments = self._ref_span = self._plot_len = None
+        self._start = self._end = None
+
+        if not keep_seq :
+            self.seq = self.qual = None
+
+    @property
+    def mean_qual(self) :
+        if self._mean_qual is None and self.qual is not None :
+            self._mean_qual = get_mean_qual(self.qual)
+        return self._mean_qual
+
+    def _parse_cigar(self) :
+        self._segments, self._ref_span, self._plot_len = parse_cigar(self.cigar)
 
+    @property
+    def segments(self) :
+        if self._segments is None : self._parse_cigar()
+        return self._segments
+
+    @property
+    def ref_span(self) :
+        if self._segments is None : self._parse_cigar()
+        return self._ref_span
+
+    @property
+    def plot_len(self) :
+        if self._segments is None : self._parse_cigar()
+        return self._plot_len
+
+    def _place(self) :
         if self.is_forward :
-            self.start = self.pos
-            self.end = self.pos+self.length
+            self._start = self.pos
+            self._end = self.pos+self.length
         else :
-            self.start = self.pos - self._shift()
-            self.end = self.start - self.plot_len
+            self._start = self.pos - self._shift()
+            self._end = self._start - self.plot_len
+
+    @property
+    def start(self) :
+        if self._start is None : self._place()
+        return self._start
+
+    @property
+    def end(self) :
+        if self._start is None : self._place()
+        return self._end
 
     def _shift(self) :
         try:
             if self.segments[0][0] in {"S", "H"}:
+                # reverse reads starting with a clip are shifted by the length of the clip,
+                # see the "clipped" counter of vizu_stats.Stats
                 shift = self.segments[0][1]
-                logger.warning(
-                    f"Read starting with a clip, shifted by -{shift} : {self}")
             else:
                 shift = 0
         except IndexError:  # cas où le cigar == "*"
@@ -139,67 +274,21 @@ class Read():
 
         return shift
 
-    def plot(self, ax:plt.axes, ypos:int, **kwargs) :
-        """
-        Plots an arrow representing a read on a plt.ax at the given y position.
-        
-        Kwargs are passed to plt.arrow https://matplotlib.org/stable/api/_as_gen/matplotlib.pyplot.arrow.html 
-        """
-        if hasattr(self, "color") : 
-            color = self.color
-        elif self.is_properly_paired :
-            color = MAPQ_COLORS_PROPERLY_PAIRED(self.mapQ)
-        else :
-            color = MAPQ_COLORS(self.mapQ)
-
-        cursor_pos = self.start
-
-        # defining colors and widths for the different types of segments
-        colors = {"H" : "black", "S" : "grey", "D" : "red", "I" : "green"}
-        widths = {"D" : 0.3, "I" : 0.9}
-
-        for i, segment in enumerate(self.segments) :
-            operation, length = segment
-            # we use the MAPQ color only for "M" segments, aka matches
-            # for other segments, we use defined colors
-            s_color = colors.get(operation, color)
-            # same logic for the arrow width
-            width = widths.get(operation, 0.8)
-            head_width = width if operation != "D" else 0.3
-
-            # for insertions, we make sure they appear on top and we center them
-            if operation == "I" : 
-                z_order = 2 
-                drift = (length/2) if self.is_forward else (-length/2)
-            else : 
-                z_order = 1
-                drift = 0
-
-            if self.is_forward :
-                head_length = 4 if i+1 == len(self.segments) else 0 # tracing the arrow head only for the tip of the read
-                ax.arrow(
-                    x=cursor_pos+drift, y=ypos, dx=length, 
-                    dy=0, width=width, head_width=head_width, 
-                    head_length=head_length, length_includes_head=True, 
-                    color=s_color, zorder=z_order,
-                    **kwargs
-                )
-            else :
-                head_length = 4 if i==0 else 0 # tracing the arrow head only for the tip of the read
-                # for reverse reads, the position of clipped reads has to be shifted 
-                # if i == 0 and operation in {"S", "H"} : 
-                #     cursor_pos -= length
-                #     logging.warning(f"Shifting read {self} by -{length}")
-                ax.arrow(
-                    x=cursor_pos+length+drift, y=ypos, dx=-length, 
-                    dy=0, width=width, head_width=head_width, 
-                    length_includes_head=True, head_length=head_length, 
-                    color=s_color, zorder=z_order,
-                    **kwargs
-                )   
-
-            # for insertions, the reference span stay the same
-            if operation != "I" : cursor_pos += length 
+    def plot(self, ax, ypos:int, min_length:float=None, **kwargs) :
+        """Plots an arrow representing the read on a plt.ax at the given y position, see vizu_plot.plot_read"""
+        from vizu_plot import plot_read
+        plot_read(ax, self, ypos, min_length, **kwargs)
+
+    def polygons(self, ypos:int, min_length:float=None) :
+        """Yields a (vertices, color, zorder) tuple for each segment of the read, see vizu_plot.read_polygons"""
+        from vizu_plot import read_polygons
+        return read_polygons(self, ypos, min_length)
+
+    @staticmethod
+    def plot_batch(ax, reads:list["Read"], ypositions:list[int], min_length:float=None, **kwargs) :
+        """Plots many reads at once on a plt.ax, see vizu_plot.plot_batch"""
+        from vizu_plot import plot_batch
+        return plot_batch(ax, reads, ypositions, min_length, **kwargs)
 
     def overlap(self, o:"Read") :
         """
@@ -218,6 +307,22 @@ class Read():
     def __repr__(self) -> str:
         return str(self)
 
+_NAMES = {}    # chromosome names already decoded, the same str object being shared by the reads
+
+def _name(raw:bytes) -> str :
+    name = _NAMES.get(raw)
+    if name is None :
+        name = _NAMES[raw] = raw.decode()
+    return name
+
+def parse_records(lines, keep_seq:bool=True) -> list[Read] :
+    """
+    Returns the reads of many lines of the output of `samtools view` at once, as str or bytes 
+    (eg the raw output of a subprocess). Blank lines and header lines are skipped.
+    """
+    from_sam = Read.from_sam
+    return [from_sam(line, keep_seq) for line in lines if line[:1] not in ("@", b"@") and line.strip()]
+
 def parse_position(pos:str) :
     """
     Parse a genomic position from a string. Chromosomes can be named "chr" or simply called by number
@@ -237,169 +342,187 @@ def parse_position(pos:str) :
         raise ValueError(f"Could not parse the string '{pos}' into valid positions with the regex '{regex}'")
 
 
-def get_reads_from(bam_file, position, samtools_command="samtools", samtools_options=""):
+def parse_region(position) :
     """
-    Returns a generator of reads from a given region. 
-    If samtools isn't in your path, you can overwrite the default samtools_command kwarg by an appropriate one.
-
-    You can use the helper function parse_position() to input a string similar to what you could give to IGV or UCSC genome browser.
-
-    You can use the samtools_options kwarg to specify filtering options to the `samtools view` command, eg 
-    ```py
-    position = parse_position("chr11:36,270,167-36 270 242")
-    reads = get_reads_from(f, *position, samtools_command="samtools")
-
-    # OR convert to list for multiple iterations over the reads : 
-    list_of_reads = list(get_reads_from(...))
-    last_read = list_of_reads[-1]
-    ```
+    Returns a (chrom, start, end) tuple from a position given as a tuple/list of 3 elements or as a string.
+    For a string holding only a chromosome name (eg "chr14"), start and end are None.
     """
     if isinstance(position, tuple) or isinstance(position, list) :
         try :
             chrom, start, end = position
         except Exception :
             raise Exception("The tuple or list passed as the position argument must have 3 elements, no more, no less. Three shall be the number thou shalt count, and the number of the counting shall be three. Four shalt thou not count, neither count thou two, excepting that thou then proceed to three. Five is right out")
+        return chrom, int(str(start).replace(",", "").replace(" ", "")), int(str(end).replace(",", "").replace(" ", ""))
     elif isinstance(position, str) :
         try :
             chrom, start, end = parse_position(position)
-            region = f"{chrom}:{start}-{end}"
+            return chrom, int(start), int(end)
         except ValueError :
             if "chr" in position :
-                region = position
+                # whole chromosome, or a region samtools will understand
+                return position.strip(), None, None
             else :
                 raise
 
     else :
         raise Exception("position argument expected either a tuple or a string")
 
-    samtools = f"{samtools_command} view {samtools_options} {bam_file} {region}"
-    print(samtools)
-    sam = sp.Popen(samtools.split() , stdout=sp.PIPE, stderr=sp.PIPE)
-    cut_command = "cut -f 2,3,4,5,6,7,8,10,11"
-    cut = sp.Popen(cut_command.split(), stdin=sam.stdout, stdout=sp.PIPE)
-    for line in cut.stdout.readlines() :
-        yield Read(line.decode()) 
 
+def _mate_is_on(line:bytes, mate:bytes) -> bool :
+    """tells if the mate of a sam line is on the `mate` chromosome, looking only at the raw bytes"""
+    fields = line.split(b"\t", 7)
+    # the 7th field is the chromosome of the mate, "=" for the same chromosome as the read
+    rnext = fields[6]
+    return rnext == mate or (rnext == b"=" and fields[2] == mate)
 
-def plot_region(
-    bam_file:str=None, region:str=None, ax:plt.Axes=None, 
-    reads=[], samtools_command="samtools", samtools_options="", 
-    piling="spaced", **kwargs) :
-    """
-    Plots reads from a specific region on a matplotlib ax. Returns the list of Read objects.
-    
-    By default, the reads will be piled up with an algorithm trying to optimize the space they use on the plot.
-    This algorithm can be changed with the `piling` kwarg and accepts :
-    - "compact" : the reads will take the minimum amount of space possible
-    - "spaced"  : same as compact, but with some spacing on the left and the right of each read
-    - "seq"     : the reads are placed on the bottom of the graph again only if there is a break between the reads
-    - None      : each read corresponds to a line on the graph
 
-    A list of reads can be directly passed. In that case, every other arguments except `ax` will be ignored.
-    This is useful if you wanna retrieve a list of reads and perform custom operations on them before plotting them. 
+def _mate_lines(lines, mate:bytes) :
+    """keeps the sam lines whose mate is on the `mate` chromosome"""
+    for line in lines :
+        if _mate_is_on(line, mate) :
+            yield line
+
+
+def _parse(records, make, stats=None) :
+    """yields the reads created by `make` from each record, timing the fetch and parse stages when stats are given"""
+    if stats is None :
+        yield from map(make, records)
+        return
+
+    parse = 0.0
+    try :
+        for record in stats.timed(records, "fetch") :
+            start = time.perf_counter()
+            read = make(record)
+            parse += time.perf_counter() - start
+            stats.count("reads")
+            yield read
+    finally :
+        stats.add_time("parse", parse)
+
+
+def _samtools_reads(args:list, keep_seq:bool=True, mate_chrom:str=None, stats=None) :
+    """runs `samtools view` with the given arguments and yields the reads as they are written, see get_reads_from"""
+    samtools = shlex.join(args)
+    logger.debug(samtools)
+    sam = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE, bufsize=SAMTOOLS_BUFFER)
+
+    # stderr is read in a thread as it comes, samtools would block on a full pipe otherwise
+    stderr = deque(maxlen=STDERR_LINES)
+    stderr_thread = threading.Thread(target=lambda : stderr.extend(sam.stderr), daemon=True)
+    stderr_thread.start()
+
+    lines = sam.stdout if mate_chrom is None else _mate_lines(sam.stdout, mate_chrom.encode())
+    try :
+        yield from _parse(lines, lambda line : Read.from_sam(line, keep_seq=keep_seq), stats)
+
+        sam.wait()
+        stderr_thread.join()
+        if sam.returncode != 0 :
+            raise SamtoolsError(f"'{samtools}' exited with code {sam.returncode} : {b''.join(stderr).decode(errors='replace')}")
+    finally :
+        # the consumer stopped early (or something failed), samtools is not needed anymore
+        if sam.poll() is None :
+            sam.kill()
+            sam.wait()
+        sam.stdout.close()
 
+
+def get_reads_from(bam_file, position, samtools_command="samtools", samtools_options="", backend="auto", keep_seq=True, mate_chrom=None, stats=None):
+    """
+    Returns a generator of reads from a given region. 
+    Reads are yielded as samtools outputs them, so the memory used doesn't depend on the size of the region, 
+    and samtools is killed if the generator is closed before the end. A SamtoolsError is raised if samtools fails.
     If samtools isn't in your path, you can overwrite the default samtools_command kwarg by an appropriate one.
 
-    You can filter reads by passing additional options to the samtools command. See `samtools view --help` for all available options. 
-    Options that make samtools write it's output to a file instead of stdout are to avoid.
+    When the bam file is indexed (a .bai next to it), the reads are read directly from the bam file 
+    without calling samtools (see vizu_bam.py). This native backend only handles the -f, -F and -q options, 
+    with any other option the samtools command is used. The `backend` kwarg can force one or the other : "auto", "native" or "samtools".
 
-    Flags explanation for the -f, -F and -G options : https://broadinstitute.github.io/picard/explain-flags.html
+    With keep_seq=False, the sequence and qualities of the reads are not kept (see Read).
 
-    Additional kwargs are passed to plt.arrow https://matplotlib.org/stable/api/_as_gen/matplotlib.pyplot.arrow.html 
+    With `mate_chrom`, only the reads whose mate is mapped on this chromosome are returned. The check is done
+    on the raw records, before any Read is created, which is much faster than filtering on `receiver_chr` afterwards.
 
+    A vizu_stats.Stats object can be given with the `stats` kwarg to record the time spent fetching and parsing the reads.
+
+    `position` can also be a list of regions or the path of a BED file. In that case, the regions are all retrieved 
+    in one pass over the bam file and a dict {(chrom, start, end) : list of reads} is returned (see vizu_regions.py).
+
+    You can use the helper function parse_position() to input a string similar to what you could give to IGV or UCSC genome browser.
+
+    You can use the samtools_options kwarg to specify filtering options to the `samtools view` command, eg 
+    ```py
+    position = parse_position("chr11:36,270,167-36 270 242")
+    reads = get_reads_from(f, *position, samtools_command="samtools")
+
+    # OR convert to list for multiple iterations over the reads : 
+    list_of_reads = list(get_reads_from(...))
+    last_read = list_of_reads[-1]
     ```
-    # create sublots
-    fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(12,5))
-    # define regions
-    region1 = (chr1, 10000, 20000)      # define a tuple
-    region2 = "chr2:4587639-5789456"    # or use a string à la IGV
-    # plot the regions on the given axes
-    plot_region(bam_file, region1, ax[0])
-    plot_region(bam_file, region2, ax[1], samtools_options="-F 2") # use the flag -F 2 to exclude all reads that are properly paired.
-    # do some additional manipulations to your axes
-    ax[1].set_title("some title")
-    plt.show()
     """
+    if is_region_list(position) :
+        return get_reads_from_regions(
+            bam_file, position, samtools_command=samtools_command, samtools_options=samtools_options,
+            backend=backend, keep_seq=keep_seq, mate_chrom=mate_chrom, stats=stats,
+        )
+    return _reads_from(bam_file, position, samtools_command, samtools_options, backend, keep_seq, mate_chrom, stats)
 
-    if ax is None : raise Exception("ax must be defined")
 
-    if reads == [] :
-        if bam_file is None : raise Exception(f"bam_file must be defined")
+def _native_filters(bam_file, chrom:str, samtools_options:str, backend:str) :
+    """
+    Returns the keyword arguments of vizu_bam.BamFile.fetch applying `samtools_options` when the native backend
+    is to be used for this query (see get_reads_from), None when samtools is
+    """
+    if backend not in {"auto", "native", "samtools"} :
+        raise Exception("backend argument has to be one of ['auto', 'native', 'samtools']")
 
-        # consuming the generator into a list so we can return it
-        reads = list(get_reads_from(bam_file, region, samtools_command=samtools_command, samtools_options=samtools_options))
-    
-    if piling is None :
-        for i, r in enumerate(reads) :
-            r.plot(ax, i, **kwargs)
+    filters = parse_filters(samtools_options)
+    native_possible = filters is not None and ":" not in chrom and find_index(bam_file) is not None
+    if backend == "native" or (backend == "auto" and native_possible) :
+        if filters is None :
+            raise Exception(f"samtools options '{samtools_options}' can't be applied by the native backend, only -f, -F and -q are supported")
+        return filters
+    return None
 
-    elif piling in {"compact", "spaced"} :
-        if piling == "spaced" :
-            padding = READ_SPACING
-        else :
-            padding = 0
-        rightmosts = [] # this will keep track of rightmost positions
-        i = 0
-        for r in reads :
-            for j, right_pos in enumerate(rightmosts) :
-                if right_pos + padding < r.start :
-                    rightmosts[j] = r.start+r.plot_len
-                    r.plot(ax, j)
-                    i = j
-                    break
-                else :
-                    i = j+1
-            else :
-                # if the loop didn't break
-                rightmosts.append(r.start+r.plot_len)
-                r.plot(ax, i)
-                        
-    elif piling == "seq" :
-        rightmost = 0
-        i = 0
-        for r in reads :
-            if r.start > rightmost :
-                i = 0
-                r.plot(ax, i)
-            else :
-                r.plot(ax, i)
 
-            if r.start + r.plot_len > rightmost :
-                rightmost = r.start + r.plot_len
-            i += 1
+def _reads_from(bam_file, position, samtools_command, samtools_options, backend, keep_seq, mate_chrom, stats) :
+    chrom, start, end = parse_region(position)
+    region = chrom if start is None else f"{chrom}:{start}-{end}"
 
-    else :
-        raise Exception("piling argument has to be one of [None, 'compact', 'seq', 'spaced']")        
+    filters = _native_filters(bam_file, chrom, samtools_options, backend)
+    if filters is not None :
+        with BamFile(bam_file) as bam :
+            records = bam.fetch(chrom, start, end, mate_chrom=mate_chrom, keep_seq=keep_seq, **filters)
+            yield from _parse(records, lambda fields : Read.from_fields(*fields, keep_seq=keep_seq), stats)
+        return
 
-    return reads
+    yield from _samtools_reads(_samtools_args(samtools_command, samtools_options, bam_file, region), keep_seq, mate_chrom, stats)
 
-def plot_transloc(
-    f = "T30989_realigned.fixed.recal.bam",
-    c1 = "chr11",
-    c2 = "chr14",
-    s = "69,638,162",
-    e = "69,639,433"
-    ) :
 
-    fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(12,5))
-    reads = plot_region(f, (c1, s, e), ax[0], samtools_options="-F 2")
-    p = [r.pos_receiver for r in reads if r.receiver_chr == c2]
-    mi, ma = min(p), max(p)
+def _samtools_args(samtools_command:str, samtools_options:str, bam_file, region:str) -> list :
+    """arguments of the `samtools view` command giving the reads of a region"""
+    return [*shlex.split(samtools_command), "view", *shlex.split(samtools_options), str(bam_file), region]
 
-    reads2 = get_reads_from(f, c2, mi, ma, flags="-F 2")
-    plot_region(ax=ax[1], reads=reads2)
-    ax[0].set_title(f"Reads {c1}")
-    ax[1].set_title(f"Reads {c2}")    
-    plt.suptitle(f"Reads attestant d'une translocation {c1}-{c2}")
-    plt.show()
 
+# the plotting layer, only imported when one of these is used so that reading reads doesn't load matplotlib
+_PLOTTING = {
+    "plot_region", "plot_regions", "plot_transloc", "coalesce_segments", "MIN_INDEL", "MIN_PIXELS",
+    "MAPQ_COLORS_PROPERLY_PAIRED", "MAPQ_COLORS",
+}
 
-if __name__ == "__main__" : 
-    reads = get_reads_from("/home/luka/Projet/routine/hebdo/T32924_realigned.fixed.recal.bam", position="chr14", samtools_options="-F 2")
+def __getattr__(name:str) :
+    if name not in _PLOTTING :
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import vizu_plot
+    if name == "MAPQ_COLORS_PROPERLY_PAIRED" :
+        return vizu_plot.mapq_colormaps()[0]
+    if name == "MAPQ_COLORS" :
+        return vizu_plot.mapq_colormaps()[1]
+    return getattr(vizu_plot, name)
 
-    reads = [r for r in reads if r.receiver_chr == "chr11"]
-    
-    fig, ax = plt.subplots(1,1)
-    
-    plot_region(reads=reads, ax=ax)
-    plt.show()
\ No newline at end of file
+
+if __name__ == "__main__" : 
+    import sys
+    from vizu_cli import main
+    sys.exit(main())